@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Measures how long `defbuild install` takes to start and fails if it is over budget.
+
+The time of a bare interpreter is subtracted so only the cost of defbuild itself is counted.
+Run with `make bench` or `python benchmarks/startup.py [--runs N] [--budget MS]`
+"""
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+import statistics
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Importing defbuild and parsing an install command line must not pull in any of these
+_heavy_modules = ["requests", "distutils", "concurrent.futures", "defbuild.bob", "defbuild.catalog",
+                  "defbuild.versions", "defbuild.cache"]
+
+_startup = """
+import sys
+sys.argv = ["defbuild", "install"]
+import defbuild
+defbuild.init()
+"""
+
+_modules = _startup + """
+print(" ".join(x for x in {} if x in sys.modules))
+""".format(_heavy_modules)
+
+
+def _time(code, runs):
+    env = dict(os.environ, PYTHONPATH=root)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, "-c", code], env=env, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the startup time of defbuild install")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--budget", type=float, default=50, help="budget in ms on top of a bare interpreter")
+    arguments = parser.parse_args()
+
+    imported = subprocess.check_output([sys.executable, "-c", _modules], env=dict(os.environ, PYTHONPATH=root))
+    imported = imported.decode().split()
+
+    interpreter = _time("pass", arguments.runs)
+    startup = _time(_startup, arguments.runs)
+    overhead = startup - interpreter
+    print("interpreter {:.1f} ms, defbuild install {:.1f} ms, overhead {:.1f} ms (budget {:.0f} ms)".format(
+        interpreter, startup, overhead, arguments.budget))
+
+    if imported:
+        print("FAIL: heavy modules imported at startup: {}".format(", ".join(imported)))
+        sys.exit(1)
+    if overhead > arguments.budget:
+        print("FAIL: over budget")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,9 @@ import os
 import sys
 import logging
 import defbuild.commands as commands
+import defbuild.files as files
+import defbuild.session as session
+import defbuild.trace as trace
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 if not sys.version_info >= (3, 3):
@@ -11,17 +14,10 @@ if not sys.version_info >= (3, 3):
     sys.exit(1)
 
 import shutil
+import hashlib
 import configparser
 import argparse
 
-try:
-    import requests
-except ImportError:
-    ver = sys.version_info
-    logging.info("Python version is {}.{}.{}".format(ver.major, ver.minor, ver.micro))
-    logging.error("requests not found, install with `pip install requests`")
-    sys.exit(1)
-
 __version__ = "2.1.1"
 
 
@@ -32,14 +28,25 @@ class Project:
         self.source_directory = os.path.abspath(_project_path)
         self.cache_dir = os.path.join(os.path.expanduser("~"), ".builder", "cache")
         self.project_file = _get_project_file(self.source_directory)
+        self.build_directory = self.source_directory
         self.output = os.path.join(self.cache_dir, "output")
 
         self.platform = arguments.platform if hasattr(arguments, 'platform') else None
+        self.platforms = []
+        self.jobs = arguments.jobs if hasattr(arguments, 'jobs') else None
+        self.devices = arguments.devices if hasattr(arguments, 'devices') else None
         self.report = arguments.report if hasattr(arguments, 'report') else None
         self.quick = arguments.quick if hasattr(arguments, 'quick') else None
+        self.distclean = arguments.distclean if hasattr(arguments, 'distclean') else None
+        self.bundle_output = None
+        self.build_budget = None
+        self.build_cache_size = None
+        self.bob_cache_size = None
+        self.bob_cache_count = None
         self.force = arguments.force if hasattr(arguments, 'force') else None
         self.variant = arguments.variant if hasattr(arguments, 'variant') else None
         self.resolve = arguments.resolve if hasattr(arguments, 'resolve') else None
+        self.no_cache = arguments.no_cache if hasattr(arguments, 'no_cache') else None
         self.verbose = arguments.verbose if hasattr(arguments, 'verbose') else None
         self.name = None
         self.provision = None
@@ -48,6 +55,12 @@ class Project:
         self.private_key = None
 
         self.bob = None
+        self.jvm_options = None
+        self.cds = None
+        self.artifact_store = None
+        # Changed by the config command, key: (where to save, value)
+        self.settings = {"jvm_options": None, "cds": None, "build_budget": None, "build_cache_size": None,
+                         "bob_cache_size": None, "bob_cache_count": None, "artifact_store": None}
 
         self.ios_id = None
         self.android_id = None
@@ -55,103 +68,115 @@ class Project:
         self.android_build = None
 
         if hasattr(arguments, 'options') and arguments.options:
-            path, name = os.path.split(self.project_file)
-            shutil.copy(self.project_file, os.path.join(path, "{}_old".format(name)))
-
+            # bob builds from an overlay with the merged project file, the source tree is never modified
             options_file = os.path.abspath(arguments.options)
-            _merge_properties(self.project_file, options_file)
+            self.build_directory, self.project_file = _create_overlay(self.source_directory, self.project_file,
+                                                                      options_file, self.cache_dir)
 
         self.load()
 
+    @trace.traced("config")
     def load(self):
         config = _load_config()
         game_config = _load_game_config(self.project_file)
         self.name = game_config.get("project", "title")
         self.ios_id = game_config.get("ios", "bundle_identifier", fallback="com.example.todo")
         self.android_id = game_config.get("android", "package", fallback="com.example.todo")
+        project_config = session.load_project(self.name)
+        # What the session had when it was read, save only writes the values that differ from it
+        self.loaded = ({key: project_config.get(self.name, key, fallback=None) or None
+                        for key in ["android_build", "ios_build"]},
+                       {key: config.get("config", key, fallback=None) or None
+                        for key in ["identity", "provision", "platform", "bob", "output"]})
 
         self.bob = config.get("config", "bob", fallback="")
-        id_name = config.get(self.name, "identity", fallback="")
+        id_name = project_config.get(self.name, "identity", fallback="")
         self.identity = id_name if id_name else config.get("config", "identity", fallback="")
-        prov_name = config.get(self.name, "provision", fallback="")
+        prov_name = project_config.get(self.name, "provision", fallback="")
         self.provision = prov_name if prov_name else config.get("config", "provision", fallback="")
 
-        cert_name = config.get(self.name, "certificate", fallback=None)
+        cert_name = project_config.get(self.name, "certificate", fallback=None)
         self.certificate = cert_name if cert_name else config.get("config", "certificate", fallback="")
-        pk_name = config.get(self.name, "private-key", fallback=None)
+        pk_name = project_config.get(self.name, "private-key", fallback=None)
         self.private_key = pk_name if pk_name else config.get("config", "private-key", fallback="")
 
         self.output = config.get("config", "output") if config.has_option("config", "output") else self.output
 
+        self.build_budget = config.get("config", "build_budget", fallback="10240")
+        self.build_cache_size = config.get("config", "build_cache_size", fallback="5120")
+        self.bob_cache_size = config.get("config", "bob_cache_size", fallback="2048")
+        self.bob_cache_count = config.get("config", "bob_cache_count", fallback="10")
+
+        for key in ["jvm_options", "cds", "artifact_store"]:
+            value = project_config.get(self.name, key, fallback=None)
+            setattr(self, key, value if value else config.get("config", key, fallback=None))
+        # Build agents can point at a store without touching the session
+        self.artifact_store = os.environ.get("DEFBUILD_ARTIFACT_STORE", self.artifact_store)
+
+        if self.platform == "all":
+            self.platform = ["all"]
+        if isinstance(self.platform, list):
+            # Several platforms given with -p, these are built in parallel
+            requested = ["android", "ios"] if "all" in self.platform else self.platform
+            self.platforms = [_platform_target(x) for x in requested]
+            self.platforms = sorted(set(self.platforms), key=self.platforms.index)
+            self.platform = self.platforms[0]
+
         self.platform = self.platform if self.platform else config.get("config", "platform") if config.has_option(
             "config", "platform") else None
 
-        self.platform = "armv7-android" if self.platform in ["android", "armv7-android"] else \
-            "armv7-darwin" if self.platform in ["ios", "armv7-darwin"] else ""
+        self.platform = _platform_target(self.platform)
+        if not self.platforms and self.platform:
+            self.platforms = [self.platform]
 
         if not self.platform:
             logging.info("No platform found, specify ios or android")
 
-        if self.name not in config.sections():
+        if self.name not in project_config.sections():
             return
 
-        self.ios_build = config.get(self.name, "ios_build", fallback="")
-        self.android_build = config.get(self.name, "android_build", fallback="")
+        self.ios_build = project_config.get(self.name, "ios_build", fallback="")
+        self.android_build = project_config.get(self.name, "android_build", fallback="")
 
     def final(self):
-        # Final clean up
-        if hasattr(self.arguments, 'options') and self.arguments.options:
-            path, name = os.path.split(self.project_file)
-            os.remove(self.project_file)
-            os.rename(os.path.join(path, "{}_old".format(name)), self.project_file)
-
         self.save()
 
-    def save(self):
-        config = _load_config()
-        if not config.has_section(self.name):
-            config.add_section(self.name)
-        config.set(self.name, "ios_id", self.ios_id)
-        config.set(self.name, "android_id", self.android_id)
-
-        if self.android_build:
-            config.set(self.name, "android_build", self.android_build)
-        if self.ios_build:
-            config.set(self.name, "ios_build", self.ios_build)
-        if self.identity:
-            config.set("config", "identity", self.identity)
-        if self.provision:
-            config.set("config", "provision", self.provision)
-        config.set("config", "platform", self.platform)
-        config.set("config", "bob", self.bob)
-        config.set("config", "output", self.output)
-
-        with open(os.path.join(self.cache_dir, "session"), 'w') as f:
-            config.write(f)
+    def _session_values(self):
+        """The values save writes, as (project record, session config)"""
+        return ({"android_build": self.android_build or None,
+                 "ios_build": self.ios_build or None},
+                {"identity": self.identity or None,
+                 "provision": self.provision or None,
+                 "platform": self.platform or None,
+                 "bob": self.bob or None,
+                 "output": self.output or None})
 
+    def save(self):
+        # A value this process didn't change is left alone, another process could have saved a newer one since
+        changed = [{key: value for key, value in values.items() if value != loaded.get(key)}
+                   for values, loaded in zip(self._session_values(), self.loaded)]
+        settings = {key: value for key, value in self.settings.items() if value}
+        # The ids come from the .project file, they are the same for every process
+        session.update_project(self.name, dict(changed[0], ios_id=self.ios_id, android_id=self.android_id,
+                                               **{key: value for key, (where, value) in settings.items()
+                                                  if where == "project"}))
+        session.update(dict(changed[1], **{key: value for key, (where, value) in settings.items()
+                                           if where == "config"}))
 
-def _load_config():
-    cache_dir = os.path.join(os.path.expanduser("~"), ".builder", "cache")
-    path = os.path.join(cache_dir, "session")
-    if not os.path.exists(path):
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir, exist_ok=True)
 
-        config = configparser.RawConfigParser()
-        config.add_section('config')
+def _platform_target(platform):
+    return "armv7-android" if platform in ["android", "armv7-android"] else \
+        "armv7-darwin" if platform in ["ios", "armv7-darwin"] else ""
 
-        with open(path, 'w') as f:
-            config.write(f)
 
-    config = configparser.ConfigParser()
-    config.read(path)
-    return config
+@trace.traced("config")
+def _load_config():
+    return session.load()
 
 
+@trace.traced("config")
 def _load_game_config(project_file):
-    config = configparser.ConfigParser()
-    config.read(project_file)
-    return config
+    return session.read(project_file)
 
 
 def _get_project_file(folder):
@@ -163,7 +188,8 @@ def _get_project_file(folder):
     sys.exit(1)
 
 
-def _merge_properties(project_file, properties_file):
+@trace.traced("options")
+def _merge_properties(project_file, properties_file, target):
     project = configparser.ConfigParser()
     project.read_file(open(project_file))
     properties = configparser.ConfigParser()
@@ -174,21 +200,93 @@ def _merge_properties(project_file, properties_file):
             if not project.has_section(section_name):
                 project.add_section(section_name)
             project.set(section_name, name, value)
-    with open(project_file, "w") as f:
+
+    with files.atomic_write(target) as f:
         project.write(f)
 
 
-def init():
+@trace.traced("options")
+def _create_overlay(source_directory, project_file, options_file, cache_dir):
+    """Mirror the project with links to the source and a merged project file, returns (directory, project file)
+
+    The overlay has its own build folder so builds with different options can run side by side.
+    """
+    key = hashlib.sha1("{}\0{}".format(source_directory, options_file).encode("utf-8")).hexdigest()
+    overlay = os.path.join(cache_dir, "overlays", key)
+    # Builds of one checkout with the same options share the overlay, only one of them syncs it at a time
+    with session.locked(overlay):
+        _sync_overlay(source_directory, os.path.basename(project_file), overlay)
+        merged = os.path.join(overlay, os.path.basename(project_file))
+        _merge_properties(project_file, options_file, merged)
+    return overlay, merged
+
+
+def _sync_overlay(source_directory, project_name, overlay):
+    os.makedirs(overlay, exist_ok=True)
+    entries = [x for x in os.listdir(source_directory) if x not in [project_name, "build"]]
+    for x in os.listdir(overlay):
+        if x not in entries and x not in [project_name, "build"] and not x.endswith(".tmp"):
+            path = os.path.join(overlay, x)
+            if os.path.islink(path) or os.path.isfile(path):
+                os.remove(path)
+            else:
+                shutil.rmtree(path)
+
+    for x in entries:
+        source = os.path.join(source_directory, x)
+        link = os.path.join(overlay, x)
+        if os.path.islink(link) and os.readlink(link) == source:
+            continue
+        if os.path.islink(link) or os.path.isfile(link):
+            os.remove(link)
+        elif os.path.isdir(link):
+            shutil.rmtree(link)
+        try:
+            os.symlink(source, link, target_is_directory=os.path.isdir(source))
+        except FileExistsError:
+            raise
+        except (NotImplementedError, OSError):
+            # No symlink support (Windows without developer mode), copy instead
+            if os.path.isdir(source):
+                shutil.copytree(source, link)
+            else:
+                shutil.copy2(source, link)
+
+
+def _add_device_arguments(parser):
+    parser.add_argument("-d", "--device", help="only use devices whose serial starts with this, can be given "
+                                               "several times", dest="devices", action="append")
+    parser.add_argument("-j", "--jobs", help="max number of devices to work on at the same time", dest="jobs",
+                        type=int)
+
+
+def init(argv=None):
     parser = argparse.ArgumentParser(description='Commandline tool to build a Defold project')
     sub_parsers = parser.add_subparsers(dest="command")
     parser.add_argument('--version', action='version', version="DefBuild {}".format(__version__))
+    parser.add_argument('--offline', help="never use the network, only cached version information and bob jars",
+                        action='store_true', dest="offline")
+    parser.add_argument('--daemon', help="run the command in 'defbuild serve' if it is running, also enabled by "
+                                         "setting DEFBUILD_DAEMON", action='store_true', dest="daemon")
+    parser.add_argument('--profile', help="write a trace of the run in the chrome trace event format to "
+                                          "~/.builder/cache/traces", dest="profile", action='store_true')
+    parser.add_argument('--profile-output', help="with --profile, write the trace to this path instead",
+                        dest="profile_output")
+    parser.add_argument('--cprofile', help="write a cProfile dump of the python code to this path", dest="cprofile")
+    parser.add_argument('--priority', help="with --daemon, queued commands with a lower number start first",
+                        dest="priority", type=int)
 
     sub_build = sub_parsers.add_parser("build", help="Build a Defold project")
     sub_build.add_argument("project", help="source directory of project")
-    sub_build.add_argument("-p", "--platform", help="which platform to build, 'ios' or 'android'", dest="platform",
-                           choices=["android", "ios"])
-    sub_build.add_argument("-q", "--quick", help="option to do a quick build by skipping distclean",
+    sub_build.add_argument("-p", "--platform", help="which platform to build, 'ios', 'android' or 'all'. Can be "
+                                                    "given several times to build the platforms in parallel",
+                           dest="platform", choices=["android", "ios", "all"], action="append")
+    sub_build.add_argument("-j", "--jobs", help="max number of platforms to build at the same time", dest="jobs",
+                           type=int)
+    sub_build.add_argument("-q", "--quick", help="kept for compatibility, builds skip distclean by default",
                            action='store_true', dest="quick")
+    sub_build.add_argument("-c", "--distclean", help="run distclean before building", action='store_true',
+                           dest="distclean")
     sub_build.add_argument("-o", "--options", help="Read options from properties file. Options specified on the "
                                                    "commandline will be given precedence over the ones read from "
                                                    "the properties file", dest="options")
@@ -199,48 +297,232 @@ def init():
                            choices=["release", "debug"], default="debug")
     sub_build.add_argument("--resolve", help="Resolve all external library dependencies", dest="resolve",
                            action="store_true")
+    sub_build.add_argument("--no-cache", help="always run bob, even if the same build is already cached",
+                           dest="no_cache", action="store_true")
+
+    sub_watch = sub_parsers.add_parser("watch", help="Build and install the project every time it changes")
+    sub_watch.add_argument("project", help="source directory of project", nargs="?")
+    sub_watch.add_argument("-p", "--platform", help="which platform to build, 'ios' or 'android'", dest="platform",
+                           choices=["android", "ios"])
+    sub_watch.add_argument("-o", "--options", help="Read options from properties file", dest="options")
+    sub_watch.add_argument("--variant", help="specify debug or release of the engine", dest="variant",
+                           choices=["release", "debug"], default="debug")
+    sub_watch.add_argument("--delay", help="seconds without changes before building, default 0.5", dest="delay",
+                           type=float, default=0.5)
+    sub_watch.add_argument("--interval", help="seconds between looking for changes, default 0.25", dest="interval",
+                           type=float, default=0.25)
+    sub_watch.add_argument("--cancel", help="stop a running build when the project changes instead of building "
+                                            "again after it", dest="cancel", action="store_true")
+    sub_watch.add_argument("--no-install", help="only build", dest="no_install", action="store_true")
+    sub_watch.add_argument("--start", help="start the app after installing it, android only", dest="start",
+                           action="store_true")
+    sub_watch.add_argument("--no-cache", help="always run bob, even if the same build is already cached",
+                           dest="no_cache", action="store_true")
+    sub_watch.add_argument("--verbose", help="print verbose logs", dest="verbose", action="store_true")
+    _add_device_arguments(sub_watch)
 
     sub_install = sub_parsers.add_parser("install", help="Install a project to a connected device")
     sub_install.add_argument("project", help="what to install", nargs="?")
     sub_install.add_argument("-f", "--force", help="force installation by uninstalling first", action='store_true',
                              dest="force")
-    sub_install.add_argument("-p", "--platform", help="which platform to install on, 'ios' or 'android'", nargs="?",
-                             dest="platform")
+    sub_install.add_argument("-p", "--platform", help="which platform to install on, 'ios', 'android' or 'all'",
+                             nargs="?", dest="platform")
+    _add_device_arguments(sub_install)
 
     sub_uninstall = sub_parsers.add_parser("uninstall", help="Uninstall the Defold project on a connected device")
     sub_uninstall.add_argument("project", help="which app to uninstall", nargs="?")
-    sub_uninstall.add_argument("-p", "--platform", help="which platform to uninstall, 'ios' or 'android'", nargs="?",
-                               dest="platform")
-
-    sub_parsers.add_parser("start")
-
-    sub_parsers.add_parser("listen")
+    sub_uninstall.add_argument("-p", "--platform", help="which platform to uninstall, 'ios', 'android' or 'all'",
+                               nargs="?", dest="platform")
+    _add_device_arguments(sub_uninstall)
+
+    sub_start = sub_parsers.add_parser("start")
+    sub_start.add_argument("project", help="which app to start", nargs="?")
+    _add_device_arguments(sub_start)
+
+    sub_listen = sub_parsers.add_parser("listen", help="Show the log of the connected android devices")
+    sub_listen.add_argument("project", help="which app to listen to", nargs="?")
+    sub_listen.add_argument("-d", "--device", help="only use devices whose serial starts with this, can be given "
+                                                   "several times", dest="devices", action="append")
+    sub_listen.add_argument("-i", "--include", help="only show lines matching this regex, can be given several times",
+                            dest="include", action="append")
+    sub_listen.add_argument("-e", "--exclude", help="hide lines matching this regex, can be given several times",
+                            dest="exclude", action="append")
+    sub_listen.add_argument("-o", "--output", help="also write the log to this file, or a file in this folder",
+                            dest="output")
+    sub_listen.add_argument("--max-size", help="size in MB before the log file is rotated, default 10",
+                            dest="max_size", type=int, default=10)
+    sub_listen.add_argument("--backups", help="how many rotated log files to keep, default 5", dest="backups",
+                            type=int, default=5)
+    sub_listen.add_argument("--tail", help="how many of the last lines to keep in memory, default 1000",
+                            dest="tail", type=int, default=1000)
+    sub_listen.add_argument("-q", "--quiet", help="don't show the lines as they come, only the kept lines at the end",
+                            dest="quiet", action="store_true")
+    sub_listen.add_argument("--tag", help="the logcat tag to listen to, default 'defold'", dest="tag",
+                            default="defold")
 
     sub_config = sub_parsers.add_parser("config")
     sub_config.add_argument("key", help="key to update")
-    sub_config.add_argument("value", help="the value to assign to key")
+    sub_config.add_argument("value", help="the value to assign to key, put -- in front of values starting with -")
+    sub_config.add_argument("--local", help="only use the value for the project in the current directory, "
+                                            "for 'jvm_options', 'cds' and 'artifact_store'", dest="local",
+                            action="store_true")
 
     sub_bob = sub_parsers.add_parser("bob", help="Update or set the version of bob that is used")
     sub_bob.add_argument("-u", "--update", help="update bob", action='store_true', dest="update")
     sub_bob.add_argument("-f", "--force", help="force download of bob", action='store_true', dest="force")
     sub_bob.add_argument("--set", help="download a specific version of bob, takes version number and 'beta'",
                          dest="set")
+    sub_bob.add_argument("--prefetch", help="download several versions at once, either a range '1.2.140..1.2.150' "
+                                            "or a list '1.2.140,1.2.143,beta'", dest="prefetch")
+    sub_bob.add_argument("-j", "--jobs", help="max number of parallel downloads for --prefetch", dest="jobs",
+                         type=int)
+    sub_bob.add_argument("--list", help="list the cached versions of bob", action='store_true', dest="list")
+    sub_bob.add_argument("--prune", help="remove the least recently used versions of bob that are over the "
+                                         "bob_cache_size (MB) or bob_cache_count limits", action='store_true',
+                         dest="prune")
 
     sub_resolve = sub_parsers.add_parser("resolve")
     sub_resolve.add_argument("project", help="source directory", nargs="?")
-
-    input_args = parser.parse_args()
+    sub_resolve.add_argument("--no-cache", help="always run bob resolve, even if the dependencies haven't changed",
+                             dest="no_cache", action="store_true")
+
+    sub_bisect = sub_parsers.add_parser("bisect", help="Find the first bob version where a check fails")
+    sub_bisect.add_argument("project", help="source directory of project", nargs="?")
+    sub_bisect.add_argument("--good", help="a version where the check passes", dest="good", required=True)
+    sub_bisect.add_argument("--bad", help="a newer version where the check fails", dest="bad", required=True)
+    sub_bisect.add_argument("--check", help="command run after each build with the bundle in $DEFBUILD_BUNDLE, "
+                                            "exit code 0 is good, 125 can't test and anything else is bad",
+                            dest="check", required=True)
+    sub_bisect.add_argument("-p", "--platform", help="which platform to build, 'ios' or 'android'", dest="platform",
+                            choices=["android", "ios"])
+    sub_bisect.add_argument("--variant", help="specify debug or release of the engine", dest="variant",
+                            choices=["release", "debug"], default="debug")
+    sub_bisect.add_argument("-j", "--jobs", help="how many versions to build and check at the same time",
+                            dest="jobs", type=int)
+    sub_bisect.add_argument("--no-cache", help="always run bob, even if the same build is already cached",
+                            dest="no_cache", action="store_true")
+
+    sub_matrix = sub_parsers.add_parser("matrix", help="Run all build jobs in a matrix file")
+    sub_matrix.add_argument("file", help="file with a section per job, keys: project, platform, variant, options, "
+                                         "bob and distclean")
+    sub_matrix.add_argument("-o", "--output", help="where to collect the bundles and logs of the jobs",
+                            dest="output")
+    sub_matrix.add_argument("-j", "--jobs", help="max number of jobs to run at the same time, by default it depends "
+                                                 "on the cores and memory of the machine", dest="jobs", type=int)
+    sub_matrix.add_argument("--no-cache", help="always run bob, even if the same build is already cached",
+                            dest="no_cache", action="store_true")
+    sub_matrix.add_argument("--verbose", help="print verbose logs", dest="verbose", action="store_true")
+
+    sub_workspace = sub_parsers.add_parser("workspace", help="Build all Defold projects found under a folder")
+    sub_workspace.add_argument("root", help="folder to search for projects")
+    sub_workspace.add_argument("-f", "--filter", help="only build projects whose relative path matches this "
+                                                      "pattern, can be given several times", dest="filters",
+                               action="append")
+    sub_workspace.add_argument("-p", "--platform", help="which platform to build, 'ios' or 'android'",
+                               dest="platform", choices=["android", "ios"])
+    sub_workspace.add_argument("--variant", help="specify debug or release of the engine", dest="variant",
+                               choices=["release", "debug"], default="debug")
+    sub_workspace.add_argument("-c", "--distclean", help="run distclean before building", action='store_true',
+                               dest="distclean")
+    sub_workspace.add_argument("-j", "--jobs", help="max number of projects to build at the same time, by default "
+                                                    "it depends on the cores and memory", dest="jobs", type=int)
+    sub_workspace.add_argument("--list", help="only list the projects", action="store_true", dest="list")
+    sub_workspace.add_argument("--refresh", help="search for projects even if nothing seems to have changed",
+                               action="store_true", dest="refresh")
+    sub_workspace.add_argument("--no-cache", help="always run bob, even if the same build is already cached",
+                               dest="no_cache", action="store_true")
+    sub_workspace.add_argument("--verbose", help="print verbose logs", dest="verbose", action="store_true")
+
+    sub_serve = sub_parsers.add_parser("serve", help="Run build, install and resolve commands sent with --daemon")
+    sub_serve.add_argument("-j", "--jobs", help="max number of commands running at the same time, one per project",
+                           dest="jobs", type=int, default=os.cpu_count() or 2)
+
+    sub_stats = sub_parsers.add_parser("stats", help="Show statistics of earlier builds")
+    sub_stats.add_argument("-n", "--name", help="only show builds of this project title", dest="project")
+    sub_stats.add_argument("--slowest", help="how many of the slowest configurations to show", dest="slowest",
+                           type=int, default=5)
+
+    input_args = parser.parse_args(argv)
 
     return input_args
 
 
-def run():
-    options = init()
+def _load_catalog(options):
+    # requests is only imported by the commands that look up bob versions
+    try:
+        import requests
+    except ImportError:
+        ver = sys.version_info
+        logging.info("Python version is {}.{}.{}".format(ver.major, ver.minor, ver.micro))
+        logging.error("requests not found, install with `pip install requests`")
+        sys.exit(1)
+    import defbuild.catalog as catalog
+
+    # Only the commands that download bob need fresh version information, the rest works from the local catalog
+    # matrix goes online only when a job names a bob version
+    catalog.offline = options.offline or options.command not in ["bob", "bisect"]
+
+
+def run(argv=None):
+    options = init(argv)
+
+    if options.command == "serve":
+        import defbuild.server as server
+        server.serve(options.jobs, init, run)
+        return
+    if argv is None and (options.daemon or os.environ.get("DEFBUILD_DAEMON")):
+        import defbuild.server as server
+        if options.command in server.priorities:
+            code = server.send([x for x in sys.argv[1:] if x != "--daemon"], options.priority)
+            if code is not None:
+                sys.exit(code)
+
+    if options.profile or options.cprofile:
+        _profile(options)
+    else:
+        _run_command(options)
+
+
+def _profile(options):
+    """Run the command while recording a trace and optionally a cProfile of it"""
+    import time
+
+    profiler = None
+    if options.profile:
+        trace.enable()
+    if options.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        with trace.span("defbuild {}".format(options.command), "defbuild"):
+            _run_command(options)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(options.cprofile)
+            logging.info("Python profile written to {}, read it with 'python -m pstats'".format(options.cprofile))
+        if options.profile:
+            name = "{}_{}_{}.json".format(options.command, time.strftime("%Y%m%d-%H%M%S"), os.getpid())
+            path = options.profile_output or os.path.join(os.path.expanduser("~"), ".builder", "cache", "traces", name)
+            trace.write(path)
+            logging.info("Trace written to {}, open it in chrome://tracing or https://ui.perfetto.dev".format(path))
+
+
+def _run_command(options):
     project = None
+    if options.command in ["bob", "build", "resolve", "bisect", "matrix", "workspace", "watch"]:
+        _load_catalog(options)
     try:
         if options.command == "bob":
             config = _load_config()
             project = commands.bob(config, options)
+        elif options.command == "stats":
+            commands.stats(options)
+        elif options.command == "matrix":
+            commands.matrix(options, Project)
+        elif options.command == "workspace":
+            commands.workspace(options, Project)
         else:
             project = Project(options)
             if options.command == "build":
@@ -249,13 +531,17 @@ def run():
                 commands.install(project)
             elif options.command == "uninstall":
                 commands.uninstall(project)
+            elif options.command == "watch":
+                commands.watch(project, options)
             elif options.command == "resolve":
                 commands.resolve(project)
+            elif options.command == "bisect":
+                commands.bisect(project, options)
             elif options.command == "start":
                 commands.start(project)
             elif options.command == "listen":
-                commands.listen(project)
-            elif options.command == "set":
+                commands.listen(project, options)
+            elif options.command in ["config", "set"]:
                 commands.config_set(project, options)
             else:
                 commands.print_help()
@@ -1,8 +1,24 @@
 import os
+import re
 import sys
+import zipfile
+import threading
 import requests
+from contextlib import contextmanager
 import logging
+import defbuild.net as net
+import defbuild.files as files
+import defbuild.trace as trace
+import defbuild.catalog as catalog
 import defbuild.versions as versions
+import defbuild.session as session
+
+_chunk_size = 1024 * 1024
+_download_retries = 5
+_max_workers = 16
+
+# Where the bob jars are downloaded from, can be pointed at a mirror or a local server
+archive_url = os.environ.get("DEFBUILD_ARCHIVE_URL", "http://d.defold.com/archive")
 
 
 class Project:
@@ -10,12 +26,14 @@ class Project:
         self.config = config
         self.cache_dir = os.path.join(os.path.expanduser("~"), ".builder", "cache")
         self.bob = config.get("config", "bob", fallback="")
+        self.max_size = int(config.get("config", "bob_cache_size", fallback="2048"))
+        self.max_count = int(config.get("config", "bob_cache_count", fallback="10"))
+        self.loaded = self.bob
 
     def final(self):
-        self.config.set("config", "bob", self.bob)
-
-        with open(os.path.join(self.cache_dir, "session"), 'w') as f:
-            self.config.write(f)
+        # Only saved when changed here, so a version set by another process since isn't put back
+        if self.bob != self.loaded:
+            session.update({"bob": self.bob})
 
 
 def exists(project, sha):
@@ -33,64 +51,283 @@ def update(project, sha, force):
         project.bob = bob_exists
         logging.info("Using cached version {}".format(get_version_from_sha(sha)))
     else:
-        download(project.cache_dir, sha)
+        download(project.cache_dir, sha, force)
         project.bob = target
         logging.info("Bob set to {}".format(get_version_from_sha(sha)))
+    touch(project.bob)
+    prune(project)
 
 
-def download(cache, sha):
-    if requests.head("http://d.defold.com/archive/{}/bob/bob.jar".format(sha)).status_code > 400:
-        logging.error("Can't find bob version {}".format(sha))
-        sys.exit(1)
+def touch(jar):
+    """Mark a jar as used, the jar itself is left alone since the class data archive checks its time stamp"""
+    used = "{}.used".format(jar)
+    try:
+        with open(used, "a"):
+            os.utime(used)
+    except OSError:
+        pass
 
-    logging.info("Downloading new bob {}".format(get_version_from_sha(sha)))
 
-    bob_directory = os.path.join(cache, "bob")
-    bob_url = "http://d.defold.com/archive/{}/bob/bob.jar".format(sha)
+@contextmanager
+def in_use(jar):
+    """Mark a jar as used and keep prune from removing it while bob runs from it"""
+    touch(jar)
+    with session.locked(jar, shared=True):
+        yield
+
+
+def _related(jar):
+    # Files that belong to a jar and are removed with it, including the class data archive of every java
+    base = os.path.basename(os.path.splitext(jar)[0])
+    archives = [os.path.join(os.path.dirname(jar), x) for x in os.listdir(os.path.dirname(jar))
+                if x == "{}.jsa".format(base) or x.startswith("{}_java".format(base)) and x.endswith(".jsa")]
+    return [jar, "{}.used".format(jar), "{}.lock".format(jar)] + archives
+
+
+def cached_jars(project):
+    """All cached jars as (path, size in bytes, last used), most recently used first"""
+    bob_directory = os.path.join(project.cache_dir, "bob")
     if not os.path.exists(bob_directory):
-        os.makedirs(bob_directory, exist_ok=True)
+        return []
 
-    target = os.path.join(bob_directory, "bob_{}.jar".format(sha))
-    r = requests.get(bob_url, stream=True)
-    with open(target, "wb") as f:
-        total_size = int(r.headers.get('content-length', 0))
-        if total_size:
-            dl = 0
-            for data in r.iter_content(chunk_size=4096):
-                dl += len(data)
-                f.write(data)
-
-                # Progressbar
-                done = int(50 * dl / total_size)
-                sys.stdout.write("\r[%s%s]" % ('=' * done, ' ' * (50 - done)))
-                sys.stdout.flush()
+    jars = []
+    for x in os.listdir(bob_directory):
+        if not x.endswith(".jar"):
+            continue
+        jar = os.path.join(bob_directory, x)
+        size = sum(os.path.getsize(path) for path in _related(jar) if os.path.exists(path))
+        used = os.path.getmtime("{}.used".format(jar)) if os.path.exists("{}.used".format(jar)) else \
+            os.path.getmtime(jar)
+        jars.append((jar, size, used))
+    return sorted(jars, key=lambda x: x[2], reverse=True)
+
+
+def prune(project):
+    """Remove the least recently used jars until the cache is within the size and count limits"""
+    jars = cached_jars(project)
+    total = sum(x[1] for x in jars)
+    count = len(jars)
+    max_size = project.max_size * 1024 * 1024
+    for jar, size, _ in reversed(jars):
+        if total <= max_size and count <= project.max_count:
+            break
+        if os.path.abspath(jar) == os.path.abspath(project.bob):
+            # The version in use is never removed
+            continue
+        # Builds and downloads hold the lock of the jar, a jar in use by another process is left alone
+        lock = "{}.lock".format(jar)
+        with session.locked(jar, blocking=False) as free:
+            if not free:
+                logging.info("Not removing {}, it is in use".format(os.path.basename(jar)))
+                continue
+            logging.info("Removing cached {} ({:.0f} MB)".format(os.path.basename(jar), size / 1024 / 1024))
+            for path in _related(jar):
+                if path != lock and os.path.exists(path):
+                    os.remove(path)
+        try:
+            os.remove(lock)
+        except OSError:
+            pass
+        total -= size
+        count -= 1
+
+
+class DownloadError(Exception):
+    pass
+
+
+class _ProgressBar:
+    """A single progress bar for one or more downloads, safe to update from several threads"""
+    def __init__(self, jars=1):
+        self.jars = jars
+        self.done = 0
+        self.total_size = 0
+        self.downloaded = {}
+        self.lock = threading.Lock()
+
+    def add_total(self, size):
+        with self.lock:
+            self.total_size += size
+
+    def update(self, url, downloaded):
+        with self.lock:
+            self.downloaded[url] = downloaded
+            self._draw()
+
+    def finish_jar(self):
+        with self.lock:
+            self.done += 1
+            self._draw()
+
+    def _draw(self):
+        if not self.total_size:
+            return
+        downloaded = sum(self.downloaded.values())
+        done = min(50, int(50 * downloaded / self.total_size))
+        line = "\r[%s%s]" % ('=' * done, ' ' * (50 - done))
+        if self.jars > 1:
+            line += " {}/{} jars, {:.0f}/{:.0f} MB".format(self.done, self.jars, downloaded / 1024 / 1024,
+                                                          self.total_size / 1024 / 1024)
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+    def close(self):
+        if self.total_size:
             sys.stdout.write("\n")
-        else:
-            f.write(r.content)
+
+
+def _bob_url(sha):
+    return "{}/{}/bob/bob.jar".format(archive_url, sha)
+
+
+def download(cache, sha, force=False):
+    logging.info("Downloading new bob {}".format(get_version_from_sha(sha)))
+    progress = _ProgressBar()
+    try:
+        _fetch(cache, sha, progress, force)
+    except DownloadError as e:
+        progress.close()
+        logging.error(str(e))
+        sys.exit(1)
+    progress.close()
+
+
+def _fetch(cache, sha, progress, force=False):
+    """Download, verify and move a jar into the cache, raises DownloadError"""
+    bob_directory = os.path.join(cache, "bob")
+    os.makedirs(bob_directory, exist_ok=True)
+    target = os.path.join(bob_directory, "bob_{}.jar".format(sha))
+
+    # Other defbuild processes wait here while one of them downloads the jar, then use the finished file
+    with trace.span("wait for download of {}".format(sha), "network"), session.locked(target):
+        if os.path.exists(target) and not force:
+            logging.info("bob {} was downloaded by another process".format(sha))
+            progress.finish_jar()
+            return target
+        return _fetch_locked(sha, target, progress)
+
+
+def _fetch_locked(sha, target, progress):
+    bob_url = _bob_url(sha)
+    try:
+        head = net.session().head(bob_url, allow_redirects=True, timeout=30)
+    except requests.RequestException as e:
+        raise DownloadError("Can't reach {}: {}".format(bob_url, e))
+    if head.status_code > 400:
+        raise DownloadError("Can't find bob version {}".format(sha))
+
+    part = "{}.part".format(target)
+    total_size = int(head.headers.get('content-length', 0))
+    etag = head.headers.get("etag", "").strip('"')
+    progress.add_total(total_size)
+
+    for attempt in range(_download_retries):
+        try:
+            _download_part(bob_url, part, total_size, progress)
+            break
+        except requests.RequestException as e:
+            logging.warning("Download of {} interrupted ({}), resuming".format(sha, e))
+    else:
+        raise DownloadError("Failed to download bob {}, try again to resume the download".format(sha))
+
+    if not _verify(part, total_size, etag):
+        os.remove(part)
+        raise DownloadError("Downloaded bob {} is corrupt, try again".format(sha))
+    os.replace(part, target)
+    progress.finish_jar()
+    return target
+
+
+@trace.traced("network")
+def _download_part(url, part, total_size, progress):
+    # Continue where a previous attempt stopped
+    downloaded = os.path.getsize(part) if os.path.exists(part) else 0
+    if total_size and downloaded >= total_size:
+        return
+
+    headers = {"Range": "bytes={}-".format(downloaded)} if downloaded else {}
+    r = net.session().get(url, stream=True, headers=headers, timeout=30)
+    r.raise_for_status()
+    if r.status_code != 206:
+        # The server doesn't support ranges, start over
+        downloaded = 0
+    progress.update(url, downloaded)
+
+    with open(part, "ab" if downloaded else "wb") as f:
+        for data in r.iter_content(chunk_size=_chunk_size):
+            downloaded += len(data)
+            f.write(data)
+            progress.update(url, downloaded)
+    if total_size and downloaded < total_size:
+        raise requests.RequestException("got {} of {} bytes".format(downloaded, total_size))
+
+
+def prefetch(project, shas, jobs=None):
+    """Download all missing jars concurrently, returns the shas that failed"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    missing = [sha for sha in shas if not exists(project, sha)]
+    if len(missing) < len(shas):
+        logging.info("{} of {} versions are already cached".format(len(shas) - len(missing), len(shas)))
+    if not missing:
+        return []
+
+    workers = min(jobs if jobs else 4, _max_workers, len(missing))
+    logging.info("Downloading {} versions of bob with {} parallel downloads".format(len(missing), workers))
+    progress = _ProgressBar(len(missing))
+
+    def fetch(sha):
+        try:
+            touch(_fetch(project.cache_dir, sha, progress))
+        except DownloadError as e:
+            return sha, str(e)
+        return sha, None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(fetch, missing))
+    progress.close()
+
+    failed = []
+    for sha, error in results:
+        if error:
+            logging.error(error)
+            failed.append(sha)
+    return failed
+
+
+@trace.traced("bob")
+def _verify(path, total_size, etag):
+    if total_size and os.path.getsize(path) != total_size:
+        logging.debug("Size mismatch, expected {} got {}".format(total_size, os.path.getsize(path)))
+        return False
+
+    # A plain md5 etag is the checksum of the whole file
+    if re.match("^[0-9a-f]{32}$", etag):
+        md5 = files.file_hash(path, "md5")
+        if md5 != etag:
+            logging.debug("Checksum mismatch, expected {} got {}".format(etag, md5))
+            return False
+
+    # Checks the crc of every entry in the jar
+    try:
+        with zipfile.ZipFile(path) as jar:
+            return jar.testzip() is None
+    except zipfile.BadZipFile:
+        return False
 
 
 def beta():
-    return versions.beta()
+    return catalog.channel("beta", max_age=0)
 
 
 def get_version_from_sha(sha):
-    json_data = versions.get(True)
-    for x in json_data["versions"]:
-        if x["sha1"] == sha:
-            return x["version"]
-    beta_sha, beta_version = beta()
-    if beta_sha == sha:
-        logging.info("Using beta version")
-        return beta_version
-    return "unknown"
+    version = catalog.version_from_sha(sha)
+    return version if version else "unknown"
 
 
 def get_sha_from_version(version):
-    json_data = versions.get(True)
-    for x in json_data["versions"]:
-        if x["version"] == version:
-            return x["sha1"]
+    return catalog.sha_from_version(version)
 
 
 def get_version_from_file_name(file_name):
-    return get_version_from_sha(file_name.replace(".jar", "").split("bob_")[-1])
\ No newline at end of file
+    return get_version_from_sha(versions.jar_sha(file_name))
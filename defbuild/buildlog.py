@@ -0,0 +1,127 @@
+import os
+import re
+import sys
+import time
+import itertools
+import logging
+import subprocess
+import defbuild.trace as trace
+
+# bob runs its commands in this order, a phase starts the first time one of its lines shows up
+_phases = [
+    ("resolve", re.compile(r"resolv", re.IGNORECASE)),
+    ("distclean", re.compile(r"clean", re.IGNORECASE)),
+    ("build", re.compile(r"build|compil", re.IGNORECASE)),
+    ("bundle", re.compile(r"bundl", re.IGNORECASE)),
+    ("signing", re.compile(r"sign", re.IGNORECASE)),
+]
+_progress = re.compile(r"(\d{1,3})\s*%")
+_counter = itertools.count()
+
+
+class BuildResult:
+    def __init__(self, platform):
+        self.platform = platform
+        self.return_code = None
+        self.duration = 0
+        self.phases = []
+        self.log = None
+        self.cached = False
+
+    @property
+    def ok(self):
+        return self.return_code == 0
+
+
+class _PhaseTracker:
+    def __init__(self, name, command, show_progress):
+        self.name = name
+        self.show_progress = show_progress
+        # Only look for the phases bob was asked to run, then they can't be confused with each other
+        self.expected = [x for x in _phases if x[0] in command or x[0] == "signing"]
+        self.index = -1
+        self.started = time.time()
+        self.phases = []
+        self.progress = None
+
+    def feed(self, line):
+        for index in range(self.index + 1, len(self.expected)):
+            phase, pattern = self.expected[index]
+            if pattern.search(line):
+                self._next(index)
+                break
+
+        match = _progress.search(line)
+        if match and match.group(1) != self.progress:
+            self.progress = match.group(1)
+            if self.show_progress:
+                sys.stdout.write("\r{} {}: {}%".format(self.name, self.current, self.progress))
+                sys.stdout.flush()
+
+    @property
+    def current(self):
+        return self.expected[self.index][0] if self.index >= 0 else "starting"
+
+    def _next(self, index):
+        now = time.time()
+        if self.show_progress and self.progress is not None:
+            sys.stdout.write("\n")
+        if self.index >= 0:
+            self.phases.append((self.current, now - self.started))
+        self.index = index
+        self.started = now
+        self.progress = None
+        logging.info("{}: {}".format(self.name, self.current))
+
+    def finish(self):
+        if self.index >= 0:
+            self.phases.append((self.current, time.time() - self.started))
+        return self.phases
+
+
+def _log_path(cache_dir, project_name, platform):
+    directory = os.path.join(cache_dir, "logs")
+    os.makedirs(directory, exist_ok=True)
+    # The counter keeps builds started in the same second by this process apart
+    name = "{}_{}_{}_{}-{}.log".format(re.sub(r"[^\w.-]", "_", project_name), platform,
+                                       time.strftime("%Y%m%d-%H%M%S"), os.getpid(), next(_counter))
+    return os.path.join(directory, name)
+
+
+def masked(command):
+    # Don't write credentials to the log
+    return " ".join("****" if index and command[index - 1] == "--auth" else x for index, x in enumerate(command))
+
+
+def run(command, cwd, cache_dir, project_name, platform, prefix=False, verbose=False, started=None):
+    """Run bob, echo and tee its output to a log file and time each phase, returns a BuildResult
+
+    started is called with the bob process, so it can be stopped from another thread.
+    """
+    result = BuildResult(platform)
+    result.log = _log_path(cache_dir, project_name, platform)
+    echo = verbose or not prefix
+    # With several builds at once the output isn't echoed, a progress line is shown instead
+    tracker = _PhaseTracker(platform, command, not echo and sys.stdout.isatty())
+    start_time = time.time()
+
+    with open(result.log, "w") as log, trace.span("bob {}".format(platform), "subprocess",
+                                                  command=masked(command), cwd=cwd) as values:
+        log.write("$ {}\n".format(masked(command)))
+        process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   universal_newlines=True, bufsize=1)
+        if started:
+            started(process)
+        for line in process.stdout:
+            log.write(line)
+            tracker.feed(line)
+            if echo:
+                sys.stdout.write("[{}] {}".format(platform, line) if prefix else line)
+        result.return_code = process.wait()
+        values["return_code"] = result.return_code
+
+    result.phases = tracker.finish()
+    result.duration = time.time() - start_time
+    if tracker.show_progress and tracker.progress is not None:
+        sys.stdout.write("\n")
+    return result
@@ -0,0 +1,246 @@
+import os
+import copy
+import json
+import shutil
+import hashlib
+import logging
+import defbuild.files as files
+import defbuild.trace as trace
+import defbuild.versions as versions
+
+# Bump when the fingerprint inputs change so old entries are not reused
+_cache_version = "2"
+# Only skipped at the project root, a build folder deeper down is part of the game
+_skip_directories = [".git", ".internal", "build"]
+
+
+def _cache_root(project):
+    return os.path.join(project.cache_dir, "builds")
+
+
+def _manifest_path(project):
+    name = hashlib.sha1(project.source_directory.encode("utf-8")).hexdigest()
+    return os.path.join(_cache_root(project), "manifests", "{}.json".format(name))
+
+
+def _load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as fp:
+            return json.load(fp)
+    except ValueError:
+        return {}
+
+
+def _save_manifest(path, manifest):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with files.atomic_write(path) as fp:
+        json.dump(manifest, fp)
+
+
+def _skipped(project, root, name, output):
+    path = os.path.join(root, name)
+    return path == output or (root == project.source_directory and name in _skip_directories)
+
+
+@trace.traced("cache")
+def tree_hash(project):
+    """Hash all files in the project and its resolved libraries, files with the same size and mtime as last time
+    reuse the stored hash"""
+    import defbuild.libraries as libraries
+
+    manifest_path = _manifest_path(project)
+    old_manifest = _load_manifest(manifest_path)
+    manifest = {}
+    output = os.path.abspath(project.output)
+
+    # .internal is skipped, except for the library zips that bob builds with
+    for directory in [project.source_directory, libraries.library_directory(project)]:
+        for root, dirs, names in os.walk(directory):
+            dirs[:] = sorted(x for x in dirs if not _skipped(project, root, x, output))
+            for file_name in names:
+                path = os.path.join(root, file_name)
+                relative = os.path.relpath(path, project.source_directory).replace(os.sep, "/")
+                stat = os.stat(path)
+                old = old_manifest.get(relative)
+                if old and old[0] == stat.st_size and old[1] == stat.st_mtime_ns:
+                    manifest[relative] = old
+                else:
+                    manifest[relative] = [stat.st_size, stat.st_mtime_ns, files.file_hash(path)]
+
+    if manifest != old_manifest:
+        _save_manifest(manifest_path, manifest)
+
+    sha1 = hashlib.sha1()
+    for relative in sorted(manifest):
+        sha1.update("{}\0{}\n".format(relative, manifest[relative][2]).encode("utf-8"))
+    return sha1.hexdigest()
+
+
+def snapshot(project):
+    """Size and mtime of every file in the project, cheap enough to poll for changes"""
+    found = {}
+    output = os.path.abspath(project.output)
+    for root, dirs, names in os.walk(project.source_directory):
+        dirs[:] = [x for x in dirs if not _skipped(project, root, x, output)]
+        for file_name in names:
+            path = os.path.join(root, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Removed while walking, the next snapshot sees it
+                continue
+            found[path] = (stat.st_size, stat.st_mtime_ns)
+    return found
+
+
+def fingerprint(project, source_hash):
+    """The key of a build, changes if anything that could change the finished bundle changes"""
+    sha1 = hashlib.sha1()
+    inputs = [_cache_version, source_hash, files.file_hash(project.project_file), versions.jar_sha(project.bob),
+              project.platform, project.variant]
+
+    if project.platform == "armv7-android":
+        if project.certificate and project.private_key:
+            inputs.extend([files.file_hash(project.certificate), files.file_hash(project.private_key)])
+    else:
+        inputs.append(project.identity)
+        if project.provision and os.path.exists(project.provision):
+            inputs.append(files.file_hash(project.provision))
+
+    for x in inputs:
+        sha1.update("{}\n".format(x).encode("utf-8"))
+    return sha1.hexdigest()
+
+
+def _bundle(project):
+    return project.android_build if project.platform == "armv7-android" else project.ios_build
+
+
+def entry_file(project, key):
+    """Where the bundle of key is kept in the cache"""
+    return os.path.join(_cache_root(project), key, os.path.basename(_bundle(project)))
+
+
+@trace.traced("cache")
+def restore(project, key):
+    """Copy a cached bundle into the output folder, returns True if there was one"""
+    entry = os.path.join(_cache_root(project), key)
+    bundle = _bundle(project)
+    cached = entry_file(project, key)
+    if not os.path.exists(cached):
+        return False
+
+    os.makedirs(os.path.dirname(bundle), exist_ok=True)
+    try:
+        shutil.copy2(cached, bundle)
+        os.utime(entry)
+    except OSError:
+        # Evicted by another build while we were copying
+        return False
+    return True
+
+
+@trace.traced("cache")
+def store(project, key):
+    bundle = _bundle(project)
+    if not os.path.exists(bundle):
+        logging.debug("No bundle found at {}, not caching".format(bundle))
+        return
+
+    entry = os.path.join(_cache_root(project), key)
+    cached = entry_file(project, key)
+    if os.path.exists(cached):
+        return
+
+    # Copy to a temporary folder first so a half written entry is never picked up
+    temp = "{}.{}.tmp".format(entry, os.getpid())
+    os.makedirs(temp, exist_ok=True)
+    shutil.copy2(bundle, os.path.join(temp, os.path.basename(bundle)))
+    try:
+        os.rename(temp, entry)
+    except OSError:
+        # Someone else stored the same build while we were copying, or a folder was left without its bundle
+        shutil.rmtree(temp, ignore_errors=True)
+        if not os.path.exists(cached):
+            with open(bundle, "rb") as source, files.atomic_write(cached, "wb") as f:
+                shutil.copyfileobj(source, f)
+    evict(project, key)
+
+
+def evict(project, keep=None):
+    """Remove the least recently used cached builds until they fit in build_cache_size"""
+    root = _cache_root(project)
+    entries = []
+    for key in os.listdir(root):
+        path = os.path.join(root, key)
+        if key == "manifests" or key == keep or key.endswith(".tmp"):
+            continue
+        try:
+            entries.append((os.path.getmtime(path), key, path, _directory_size(path)))
+        except OSError:
+            # Removed by another build
+            continue
+
+    total = sum(x[3] for x in entries)
+    budget = int(project.build_cache_size) * 1024 * 1024
+    if keep:
+        total += _directory_size(os.path.join(root, keep))
+    for _, key, path, size in sorted(entries):
+        if total <= budget:
+            break
+        logging.info("Removing cached build {} ({:.0f} MB)".format(key, size / 1024 / 1024))
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def build_key(project):
+    # The build directory is the overlay of the options file, or the source folder without options, so projects
+    # with the same title and builds with different options never share folders
+    location = hashlib.sha1(os.path.abspath(project.build_directory).encode("utf-8")).hexdigest()[:8]
+    return "{}_{}_{}_{}".format(project.platform, project.variant, versions.jar_sha(project.bob)[:10], location)
+
+
+def _directory_size(path):
+    size = 0
+    for root, dirs, names in os.walk(path):
+        for file_name in names:
+            try:
+                size += os.lstat(os.path.join(root, file_name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def evict_build_directories(project):
+    """Remove the least recently used build folders of the project until they fit in the budget"""
+    root = os.path.join(project.build_directory, "build", "defbuild")
+    if not os.path.exists(root):
+        return
+
+    keep = set(build_key(x) for x in [project] + [_with_platform(project, x) for x in project.platforms])
+    entries = []
+    for key in os.listdir(root):
+        path = os.path.join(root, key)
+        bundle = os.path.join(project.output, project.name, key)
+        size = _directory_size(path) + _directory_size(bundle)
+        entries.append((os.path.getmtime(path), key, path, bundle, size))
+
+    total = sum(x[4] for x in entries)
+    budget = int(project.build_budget) * 1024 * 1024
+    for _, key, path, bundle, size in sorted(entries):
+        if total <= budget:
+            break
+        if key in keep:
+            continue
+        logging.info("Removing old build folder {} ({:.0f} MB)".format(key, size / 1024 / 1024))
+        shutil.rmtree(path, ignore_errors=True)
+        shutil.rmtree(bundle, ignore_errors=True)
+        total -= size
+
+
+def _with_platform(project, platform):
+    worker = copy.copy(project)
+    worker.platform = platform
+    return worker
@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import logging
+import requests
+import defbuild.files as files
+import defbuild.versions as versions
+import defbuild.trace as trace
+
+_catalog_json = os.path.join(os.path.expanduser("~"), ".builder", "cache", "catalog.json")
+_channels = {"stable": versions._latest, "beta": versions._beta}
+
+# Seconds a cached beta/stable entry is used before asking the server again
+ttl = 60 * 60
+
+# When set nothing in the catalog goes to the network, unknown versions are reported as unknown
+offline = False
+
+_state = None
+_sha_to_version = None
+_version_to_sha = None
+_loaded = None
+
+
+def _load():
+    global _state
+    if _state is None:
+        _state = {}
+        if os.path.exists(_catalog_json):
+            try:
+                with open(_catalog_json, "r") as fp:
+                    _state = json.load(fp)
+            except ValueError:
+                logging.debug("Ignoring broken version catalog {}".format(_catalog_json))
+    return _state
+
+
+def _stamp():
+    return [os.path.getmtime(x) if os.path.exists(x) else None for x in [_catalog_json, versions.version_json]]
+
+
+def preload():
+    """Read the catalog and the release list now, used by the serve daemon to keep them in memory
+
+    They are read again when the files changed since the last call.
+    """
+    global _state, _sha_to_version, _version_to_sha, _loaded
+    stamp = _stamp()
+    if stamp != _loaded:
+        _state = _sha_to_version = _version_to_sha = None
+        _loaded = stamp
+    _load()
+    if os.path.exists(versions.version_json):
+        _index()
+
+
+def _save():
+    os.makedirs(os.path.dirname(_catalog_json), exist_ok=True)
+    with files.atomic_write(_catalog_json) as fp:
+        json.dump(_state, fp, indent=4, sort_keys=True)
+
+
+@trace.traced("version")
+def _index():
+    global _sha_to_version, _version_to_sha
+    if _sha_to_version is None:
+        try:
+            data = versions.get(auto_update=not offline)
+        except requests.RequestException as e:
+            # Without a release list only the cached channels are known
+            logging.warning("Could not download the release list: {}".format(e))
+            data = {}
+        _sha_to_version = {}
+        _version_to_sha = {}
+        for x in data.get("versions", []):
+            _sha_to_version[x["sha1"]] = x["version"]
+            _version_to_sha[x["version"]] = x["sha1"]
+    return _sha_to_version, _version_to_sha
+
+
+@trace.traced("version")
+def _refresh_releases():
+    """Fetch the release list again, returns True if it changed"""
+    global _sha_to_version, _version_to_sha
+    state = _load().setdefault("releases", {})
+    if offline or time.time() - state.get("checked", 0) < ttl:
+        return False
+
+    try:
+        response = versions.update(state.get("etag"), state.get("last_modified"))
+    except requests.RequestException as e:
+        logging.debug("Could not refresh the release list: {}".format(e))
+        return False
+    state["checked"] = time.time()
+    changed = response is not None and response.status_code == 200
+    if changed:
+        state["etag"] = response.headers.get("etag")
+        state["last_modified"] = response.headers.get("last-modified")
+        _sha_to_version = None
+    _save()
+    return changed
+
+
+@trace.traced("version")
+def channel(name, max_age=None):
+    """Returns (sha1, version) of the 'stable' or 'beta' channel"""
+    max_age = ttl if max_age is None else max_age
+    entry = _load().setdefault(name, {})
+    if entry.get("sha1") and (offline or time.time() - entry.get("checked", 0) < max_age):
+        return entry["sha1"], entry["version"]
+    if offline:
+        return None, None
+
+    try:
+        response = versions.fetch(_channels[name], entry.get("etag"), entry.get("last_modified"))
+        if response is not None:
+            response.raise_for_status()
+            info = response.json()
+            entry["sha1"] = info["sha1"]
+            entry["version"] = info["version"]
+            entry["etag"] = response.headers.get("etag")
+            entry["last_modified"] = response.headers.get("last-modified")
+    except requests.RequestException as e:
+        logging.warning("Could not check the {} version: {}".format(name, e))
+        return entry.get("sha1"), entry.get("version")
+
+    entry["checked"] = time.time()
+    _save()
+    return entry["sha1"], entry["version"]
+
+
+def _cached_channel(sha):
+    for name in _channels:
+        entry = _load().get(name, {})
+        if entry.get("sha1") == sha:
+            return name, entry["version"]
+    return None, None
+
+
+@trace.traced("version")
+def version_from_sha(sha):
+    """Returns the version for sha, or None if it isn't a known release"""
+    sha_to_version, _ = _index()
+    if sha in sha_to_version:
+        return sha_to_version[sha]
+
+    name, version = _cached_channel(sha)
+    if version:
+        if name == "beta":
+            logging.info("Using beta version")
+        return version
+    if offline:
+        return None
+
+    beta_sha, beta_version = channel("beta")
+    if beta_sha == sha:
+        logging.info("Using beta version")
+        return beta_version
+    if _refresh_releases():
+        return _index()[0].get(sha)
+    return None
+
+
+def releases():
+    """All known releases as (version, sha1), oldest first"""
+    _, version_to_sha = _index()
+    return sorted(version_to_sha.items(), key=lambda x: versions.version_key(x[0]))
+
+
+@trace.traced("version")
+def sha_from_version(version):
+    """Returns the sha for version, or None if it isn't a known release"""
+    _, version_to_sha = _index()
+    if version in version_to_sha:
+        return version_to_sha[version]
+
+    for name in _channels:
+        entry = _load().get(name, {})
+        if entry.get("version") == version:
+            return entry["sha1"]
+
+    if _refresh_releases():
+        return _index()[1].get(version)
+    return None
@@ -1,30 +1,112 @@
 import os
 import sys
-import defbuild.bob as _bob
+import copy
 import time
 import shutil
 import logging
-import requests
+import defbuild.trace as trace
 from subprocess import call
-from distutils.version import StrictVersion
 
 
 def build(project):
+    import defbuild.bob as _bob
+    import defbuild.cache as _cache
+    import defbuild.libraries as _libraries
+
     if not project.bob:
         logging.error("Can't find a bob version, download with 'builder bob --update'")
         sys.exit(1)
+    _bob.touch(project.bob)
     if project.verbose:
         logging.basicConfig(level=logging.DEBUG)
 
-    os.chdir(project.source_directory)
-    command = ["java", "-jar", project.bob,
-               "--archive",
-               "--platform", project.platform,
-               "--texture-compression", "true",
-               "--bundle-output", project.output]
-
+    os.chdir(project.build_directory)
     bob_version = _bob.get_version_from_file_name(project.bob)
-    if len(bob_version.split(".")) == 3 and StrictVersion(bob_version) >= StrictVersion("1.2.137"):
+    logging.info("Using bob version {}".format(bob_version))
+
+    if project.resolve and len(project.platforms) > 1:
+        # Resolve once up front, the builds share the same library folder
+        resolve(project)
+    resolving = project.resolve and len(project.platforms) == 1 and (project.no_cache or
+                                                                     not _libraries.restore(project))
+
+    # The report is written by bob so a cached build can't give us one. A resolve in the same bob run changes the
+    # libraries after the fingerprint is taken, so the resolve the user asked for always runs
+    source_hash = None
+    if not project.no_cache and not project.report and not resolving:
+        source_hash = _cache.tree_hash(project)
+
+    if len(project.platforms) > 1:
+        _build_parallel(project, bob_version, source_hash)
+    else:
+        command = _build_command(project, bob_version)
+        if resolving:
+            _libraries.prepare(project)
+            logging.info("Resolving please supply your credentials")
+            user, pw = _get_user()
+            command.extend(["--email", user, "--auth", pw, "resolve"])
+
+        if project.distclean:
+            command.extend(["distclean"])
+
+        command.extend(["build", "bundle"])
+        result = _run_build(project, command, bob_version, source_hash)
+        if resolving and result.ok:
+            _libraries.store(project)
+    _cache.evict_build_directories(project)
+
+    if project.report:
+        import webbrowser
+        for platform in project.platforms:
+            webbrowser.open("file://" + _report_path(project, platform))
+
+
+def _build_parallel(project, bob_version, source_hash):
+    from concurrent.futures import ThreadPoolExecutor
+
+    # Every platform gets its own copy of the project, the build and bundle folders are per platform so the bob
+    # processes don't write over each other
+    workers = []
+    for platform in project.platforms:
+        worker = copy.copy(project)
+        worker.platform = platform
+        command = _build_command(worker, bob_version)
+        if project.distclean:
+            command.extend(["distclean"])
+        command.extend(["build", "bundle"])
+        workers.append((worker, command))
+
+    jobs = project.jobs if project.jobs else len(workers)
+    logging.info("Building {} platforms with {} parallel jobs".format(len(workers), jobs))
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(lambda x: _run_build(x[0], x[1], bob_version, source_hash), workers))
+
+    for worker, _ in workers:
+        if worker.android_build:
+            project.android_build = worker.android_build
+        if worker.ios_build:
+            project.ios_build = worker.ios_build
+
+    logging.info("Build summary:")
+    for result in results:
+        m, s = divmod(result.duration, 60)
+        logging.info("    {:<8} {} in {:.0f}:{:.0f}{}".format(
+            result.platform, "cached" if result.cached else "done" if result.ok else "FAILED", m, s,
+            _phase_summary(result)))
+
+
+def _build_command(project, bob_version):
+    import defbuild.jvm as _jvm
+    import defbuild.versions as _versions
+
+    build_output, project.bundle_output = _build_directories(project)
+    command = _jvm.command(project) + ["--archive",
+                                       "--platform", project.platform,
+                                       "--texture-compression", "true",
+                                       "--output", build_output,
+                                       "--bundle-output", project.bundle_output]
+
+    if _versions.version_key(bob_version) >= (1, 2, 137):
         if project.variant == "debug":
             command.extend(["--variant", "debug"])
         else:
@@ -34,13 +116,13 @@ def build(project):
             command.extend(["--debug"])
 
     if project.report:
-        command.extend(["--build-report-html", os.path.join(project.cache_dir, "report.html")])
+        command.extend(["--build-report-html", _report_path(project, project.platform)])
     if project.platform == "armv7-android":
-        project.android_build = os.path.join(project.output, project.name, "{}.apk".format(project.name))
+        project.android_build = os.path.join(project.bundle_output, project.name, "{}.apk".format(project.name))
         if project.certificate and project.private_key:
             command.extend(["--certificate", project.certificate, "--private-key", project.private_key])
     else:
-        project.ios_build = os.path.join(project.output, "{}.ipa".format(project.name))
+        project.ios_build = os.path.join(project.bundle_output, "{}.ipa".format(project.name))
         if not project.identity:
             logging.error("""Please set a identity with 'set config identity "iPhone Developer: My Identity"'""")
         if not project.provision:
@@ -50,105 +132,679 @@ def build(project):
             sys.exit(1)
 
         command.extend(["--identity", project.identity, "-mp", project.provision])
+    return command
 
-    if project.resolve:
-        logging.info("Resolving please supply your credentials")
-        user, pw = _get_user()
-        command.extend(["--email", user, "--auth", pw, "resolve"])
 
-    if not project.quick:
-        command.extend(["distclean"])
+def _build_directories(project):
+    """Build and bundle folders for the platform, variant, bob version and options file, returns (build, bundle)
 
-    platform = "android" if project.platform == "armv7-android" else "ios" if project.platform == "armv7-darwin" else ""
-    logging.info("Building project {} as {} for {}".format(project.name, project.variant, platform))
-    logging.info("Using bob version {}".format(bob_version, project.variant))
+    Each combination keeps its own folders so incremental builds stay valid when switching between them.
+    """
+    import defbuild.cache as _cache
 
-    command.extend(["build", "bundle"])
-    start_time = time.time()
-    logging.info("Using command: '{}'".format(" ".join(command)))
-    call(command)
-    m, s = divmod(time.time() - start_time, 60)
-    logging.info("Building done in {:.0f}:{:.0f}".format(m, s))
+    key = _cache.build_key(project)
+    build_output = os.path.join(project.build_directory, "build", "defbuild", key)
+    os.makedirs(build_output, exist_ok=True)
+    # Marks the folder as used for the eviction
+    os.utime(build_output)
+    return build_output, os.path.join(project.output, project.name, key)
 
-    if project.report:
-        import webbrowser
-        webbrowser.open("file://" + os.path.join(project.cache_dir, "report.html"))
+
+def _run_build(project, command, bob_version, source_hash=None, started=None):
+    import defbuild.bob as _bob
+    import defbuild.cache as _cache
+    import defbuild.store as _store
+    import defbuild.jvm as _jvm
+    import defbuild.history as _history
+    import defbuild.buildlog as _buildlog
+
+    start_time = time.time()
+    bundle = project.android_build if project.platform == "armv7-android" else project.ios_build
+    key = _cache.fingerprint(project, source_hash) if source_hash else None
+    store = _store.open_store(project.artifact_store) if key else None
+    restored = key and _cache.restore(project, key)
+    if key and not restored and store and _store.download(store, key, _cache.entry_file(project, key)):
+        logging.info("Downloaded build {} from {}".format(key, store))
+        restored = _cache.restore(project, key)
+        _cache.evict(project, key)
+    if restored:
+        logging.info("Nothing changed for {}, using cached build {}".format(_platform_name(project.platform), key))
+        result = _buildlog.BuildResult(_platform_name(project.platform))
+        result.return_code = 0
+        result.cached = True
+        result.duration = time.time() - start_time
+        _history.record(project, result, bob_version, bundle)
+        return result
+
+    logging.info("Building project {} as {} for {}".format(project.name, project.variant,
+                                                            _platform_name(project.platform)))
+    logging.info("Using command: '{}'".format(_buildlog.masked(command)))
+    with _bob.in_use(project.bob):
+        result = _buildlog.run(command, project.build_directory, project.cache_dir, project.name,
+                               _platform_name(project.platform), prefix=len(project.platforms) > 1,
+                               verbose=project.verbose, started=started)
+    _jvm.finish(command)
+    if key and result.ok:
+        _cache.store(project, key)
+        if store and os.path.exists(bundle):
+            _store.upload(store, key, bundle)
+    _history.record(project, result, bob_version, bundle)
+    m, s = divmod(result.duration, 60)
+    logging.info("Building {} {} in {:.0f}:{:.0f}{}".format(_platform_name(project.platform),
+                                                           "done" if result.ok else "failed", m, s,
+                                                           _phase_summary(result)))
+    logging.info("Build log: {}".format(result.log))
+    return result
+
+
+def _phase_summary(result):
+    if not result.phases:
+        return ""
+    return " ({})".format(", ".join("{} {:.1f}s".format(name, duration) for name, duration in result.phases))
+
+
+def _report_path(project, platform):
+    if len(project.platforms) > 1:
+        return os.path.join(project.cache_dir, "report_{}.html".format(_platform_name(platform)))
+    return os.path.join(project.cache_dir, "report.html")
+
+
+def _platform_name(platform):
+    return "android" if platform == "armv7-android" else "ios" if platform == "armv7-darwin" else ""
 
 
 def install(project):
+    import defbuild.files as _files
+    import defbuild.devices as _devices
+
     if project.force:
-        uninstall(project)
+        uninstall(project, check=False)
+
+    installs = []
+    hashes = {}
+    for device in _connected_devices(project):
+        bundle = project.android_build if device.platform == "armv7-android" else project.ios_build
+        if not bundle or not os.path.exists(bundle):
+            logging.error("No {} build found for {}, skipping {}".format(
+                _platform_name(device.platform), project.name, device.serial))
+            continue
+        if bundle not in hashes:
+            hashes[bundle] = _files.file_hash(bundle)
+        package = project.android_id if device.platform == "armv7-android" else project.ios_id
+        installs.append((device, bundle, package))
+
+    if not project.force:
+        installs = _skip_installed(project, installs, hashes)
+    if not installs:
+        logging.info("All devices already have the latest build")
+        return
+
+    bundles = sorted(set(os.path.basename(bundle) for _, bundle, _ in installs))
+    logging.info("Installing {} on {} devices".format(", ".join(bundles), len(installs)))
+    results = _run_on_devices("Install", [(device, device.install_command(bundle)) for device, bundle, _ in installs],
+                              project.jobs, check=False)
+    for (device, bundle, package), result in zip(installs, results):
+        if result.ok:
+            _devices.record_install(device, package, hashes[bundle])
+    if not all(result.ok for result in results):
+        sys.exit(1)
 
-    if project.platform == "armv7-android":
-        bundle = project.android_build
-        command = ["adb", "install", bundle]
-    else:
-        bundle = project.ios_build
-        command = ["ideviceinstaller", "-i", bundle]
 
-    logging.info("Installing {}".format(os.path.basename(bundle)))
-    if not shutil.which(command[0]):
-        logging.error("Can not find dependency {}".format(command[0]))
-        sys.exit(-1)
-    call(command)
+def _skip_installed(project, installs, hashes):
+    """Drop the devices that already have this exact bundle installed"""
+    import defbuild.devices as _devices
 
+    unchanged = [x for x in installs if _devices.installed_hash(x[0], x[2]) == hashes[x[1]]]
+    if not unchanged:
+        return installs
 
-def uninstall(project):
-    if project.platform == "armv7-android":
-        logging.info("Uninstalling {}".format(project.android_id))
-        command = ["adb", "uninstall", project.android_id]
-    else:
-        logging.info("Uninstalling {}".format(project.ios_id))
-        command = ["ideviceinstaller", "-U", project.ios_id]
+    # The app could have been removed by hand since, check that it is still there
+    results = _devices.run_all([(device, device.list_command(package)) for device, _, package in unchanged],
+                               project.jobs)
+    present = [device for (device, _, package), result in zip(unchanged, results)
+               if device.has_package(result.output, package)]
+    for device in present:
+        logging.info("{} already has this build installed, skipping".format(device.serial))
+    return [x for x in installs if x[0] not in present]
 
-    if not shutil.which(command[0]):
-        logging.error("Can not find dependency {}".format(command[0]))
-        sys.exit(-1)
 
-    call(command)
+def uninstall(project, check=True):
+    commands = []
+    for device in _connected_devices(project):
+        package = project.android_id if device.platform == "armv7-android" else project.ios_id
+        commands.append((device, device.uninstall_command(package)))
+
+    logging.info("Uninstalling {} from {} devices".format(
+        ", ".join(sorted(set(command[-1] for _, command in commands))), len(commands)))
+    _run_on_devices("Uninstall", commands, project.jobs, check)
 
 
 def start(project):
-    if project.platform == "armv7-android":
-        call(["adb", "shell", "am", "start", "-n", "{}/com.dynamo.android.DefoldActivity".format(project.android_id)])
-    else:
+    if "armv7-android" not in project.platforms:
         logging.error("Starting app not supported for iOS")
         sys.exit(-1)
 
+    commands = [(device, device.start_command(project.android_id)) for device in _connected_devices(project)
+                if device.platform == "armv7-android"]
+    _run_on_devices("Start", commands, project.jobs)
+
+
+def watch(project, options):
+    """Rebuild when the project changes and install the new bundle on the connected devices"""
+    import threading
+    import defbuild.bob as _bob
+    import defbuild.cache as _cache
+
+    if not project.bob:
+        logging.error("Can't find a bob version, download with 'builder bob --update'")
+        sys.exit(1)
+    if not project.platform:
+        sys.exit(1)
+    if project.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    _bob.touch(project.bob)
+    bob_version = _bob.get_version_from_file_name(project.bob)
+    # Only one platform is watched, an installed app is replaced so it is uninstalled first
+    project.platforms = [project.platform]
+    project.force = True
+    running = {"thread": None, "process": None}
+
+    def run():
+        source_hash = None if project.no_cache else _cache.tree_hash(project)
+        command = _build_command(project, bob_version) + ["build", "bundle"]
+        result = _run_build(project, command, bob_version, source_hash,
+                            started=lambda process: running.update(process=process))
+        running["process"] = None
+        if result.ok and not options.no_install:
+            try:
+                install(project)
+                if options.start and project.platform == "armv7-android":
+                    start(project)
+            except SystemExit:
+                # Errors are already logged, keep watching
+                pass
+        logging.info("Waiting for changes")
+
+    def stop():
+        process = running["process"]
+        if process and process.poll() is None:
+            process.terminate()
+        if running["thread"]:
+            running["thread"].join()
+
+    os.chdir(project.build_directory)
+    files = _cache.snapshot(project)
+    # Build once at the start so the device is up to date
+    changed = 0
+    logging.info("Watching {} for changes, stop with Ctrl+C".format(project.source_directory))
+    try:
+        while True:
+            time.sleep(options.interval)
+            current = _cache.snapshot(project)
+            if current != files:
+                files = current
+                changed = time.time()
+                continue
+            # Wait until the saves have stopped before building
+            if changed is None or time.time() - changed < options.delay:
+                continue
+            busy = running["thread"] and running["thread"].is_alive()
+            if busy and options.cancel:
+                logging.info("Project changed, stopping the running build")
+                stop()
+            elif busy:
+                # Build again when the running build is done
+                continue
+            changed = None
+            running["thread"] = threading.Thread(target=run)
+            running["thread"].start()
+    except KeyboardInterrupt:
+        stop()
+
+
+def _connected_devices(project):
+    import defbuild.devices as _devices
+
+    if not project.platforms:
+        logging.error("No platform found, specify ios or android")
+        sys.exit(1)
+    devices = _devices.connected(project.platforms, project.devices)
+    if not devices:
+        logging.error("No connected devices found{}".format(
+            " matching {}".format(", ".join(project.devices)) if project.devices else ""))
+        sys.exit(1)
+    return devices
+
+
+def _run_on_devices(title, commands, jobs, check=True):
+    import defbuild.devices as _devices
+
+    results = _devices.run_all(commands, jobs)
+    _devices.report(title, results)
+    if check and not all(result.ok for result in results):
+        sys.exit(1)
+    return results
+
 
 def bob(config, options):
+    import defbuild.bob as _bob
+    import defbuild.catalog as _catalog
+    import defbuild.versions as _versions
+
     project = _bob.Project(config)
     if options.update:
-        latest = requests.get("http://d.defold.com/stable/info.json").json()["sha1"]
+        latest, _ = _catalog.channel("stable", max_age=0)
+        if not latest:
+            logging.error("Can't look up the latest version in offline mode")
+            sys.exit(1)
         _bob.update(project, latest, options.force)
 
     elif options.set:
         sha = options.set
         if len(sha.split(".")) == 3:
             sha = _bob.get_sha_from_version(sha)
+            if not sha:
+                logging.error("Can't find bob version {}".format(options.set))
+                sys.exit(1)
             _bob.update(project, sha, options.force)
         elif sha == "beta":
             sha, _ = _bob.beta()
+            if not sha:
+                logging.error("Can't look up the beta version in offline mode")
+                sys.exit(1)
             _bob.update(project, sha, options.force)
         else:
             _bob.update(project, sha, options.force)
+    elif options.prefetch:
+        _prefetch(project, options)
+    elif options.prune:
+        _bob.prune(project)
+    elif options.list:
+        _list_bob(project)
     else:
         if not project.bob:
             logging.error("Can't find a bob version, download with 'builder bob --update'")
             sys.exit(1)
-        sha = project.bob.split("bob_")[-1].split(".jar")[0]
+        sha = _versions.jar_sha(project.bob)
         version = _bob.get_version_from_sha(sha)
         logging.info("Using version '{}', sha1: {}\n".format(version, sha))
     return project
 
 
-def listen(project):
-    if project.platform == "armv7-android":
-        call(["adb", "logcat", "-s", "defold"])
+def _prefetch(project, options):
+    import defbuild.bob as _bob
+    import defbuild.catalog as _catalog
+    import defbuild.versions as _versions
+
+    shas = []
+    if ".." in options.prefetch:
+        first, last = options.prefetch.split("..", 1)
+        for version in [first, last]:
+            if not _bob.get_sha_from_version(version):
+                logging.error("Can't find bob version {}".format(version))
+                sys.exit(1)
+        first, last = _versions.version_key(first), _versions.version_key(last)
+        shas = [sha for version, sha in _catalog.releases() if first <= _versions.version_key(version) <= last]
     else:
+        for version in options.prefetch.split(","):
+            version = version.strip()
+            sha = _bob.beta()[0] if version == "beta" else \
+                _bob.get_sha_from_version(version) if len(version.split(".")) == 3 else version
+            if not sha:
+                logging.error("Can't find bob version {}".format(version))
+                sys.exit(1)
+            shas.append(sha)
+
+    failed = _bob.prefetch(project, shas, options.jobs)
+    if len(_bob.cached_jars(project)) > project.max_count:
+        logging.warning("There are more cached versions than bob_cache_count ({}), the least recently used ones are "
+                        "removed on the next download".format(project.max_count))
+    if failed:
+        sys.exit(1)
+
+
+def bisect(project, options):
+    """Find the first bob version between a good and a bad one where the check fails"""
+    import defbuild.bob as _bob
+    import defbuild.cache as _cache
+    import defbuild.catalog as _catalog
+    import defbuild.session as _session
+    import defbuild.versions as _versions
+    from concurrent.futures import ThreadPoolExecutor
+
+    shas = {}
+    for version in [options.good, options.bad]:
+        shas[version] = _bob.get_sha_from_version(version)
+        if not shas[version]:
+            logging.error("Can't find bob version {}".format(version))
+            sys.exit(1)
+    good, bad = _versions.version_key(options.good), _versions.version_key(options.bad)
+    if good >= bad:
+        logging.error("The good version has to be older than the bad version")
+        sys.exit(1)
+    if not project.platform:
+        logging.error("No platform found, specify ios or android")
+        sys.exit(1)
+
+    # The ends can be beta or stable channel versions that aren't in the releases, so they are added as given
+    inside = [(version, sha) for version, sha in _catalog.releases() if good < _versions.version_key(version) < bad]
+    candidates = []
+    for version, sha in [(options.good, shas[options.good])] + inside + [(options.bad, shas[options.bad])]:
+        if sha not in [x[1] for x in candidates]:
+            candidates.append((version, sha))
+    if len(candidates) < 2:
+        logging.error("{} and {} are the same bob build".format(options.good, options.bad))
+        sys.exit(1)
+    jobs = options.jobs if options.jobs else 2
+    os.chdir(project.build_directory)
+    project.platforms = [project.platform]
+    source_hash = None if project.no_cache else _cache.tree_hash(project)
+
+    # Index 0 is known good and the last index known bad, test jobs versions spread over what is left in between
+    low, high = 0, len(candidates) - 1
+    skipped = set()
+    while high - low > 1:
+        inside = [x for x in range(low + 1, high) if x not in skipped]
+        if not inside:
+            break
+        step = len(inside) / (min(jobs, len(inside)) + 1)
+        picks = sorted(set(inside[int(step * (x + 1))] for x in range(min(jobs, len(inside)))))
+        logging.info("Bisecting {} versions between {} and {}, testing {}".format(
+            high - low - 1, candidates[low][0], candidates[high][0], ", ".join(candidates[x][0] for x in picks)))
+
+        if _bob.prefetch(_bob.Project(_session.load()), [candidates[x][1] for x in picks], jobs):
+            sys.exit(1)
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(lambda x: _bisect_check(project, options, candidates[x], source_hash),
+                                        picks))
+
+        for index, result in zip(picks, results):
+            logging.info("    {:<10} {}".format(candidates[index][0], result))
+            if result == "skip":
+                skipped.add(index)
+        bad_picks = [index for index, result in zip(picks, results) if result == "bad"]
+        if bad_picks:
+            high = bad_picks[0]
+        good_picks = [index for index, result in zip(picks, results) if result == "good" and index < high]
+        if good_picks:
+            low = good_picks[-1]
+
+    untested = [candidates[x][0] for x in range(low + 1, high)]
+    if untested:
+        logging.info("Could not decide between {} (skipped)".format(", ".join(untested)))
+    logging.info("Last good version: {} ({})".format(*candidates[low]))
+    logging.info("First bad version: {} ({})".format(*candidates[high]))
+    _cache.evict_build_directories(project)
+
+
+def _bisect_check(project, options, candidate, source_hash):
+    """Build with one bob version and run the check on the bundle, returns 'good', 'bad' or 'skip'"""
+    import defbuild.bob as _bob
+
+    version, sha = candidate
+    worker = copy.copy(project)
+    worker.bob = _bob.exists(project, sha)
+    command = _build_command(worker, version) + ["build", "bundle"]
+    result = _run_build(worker, command, version, source_hash)
+    if not result.ok:
+        logging.info("Build with {} failed, see {}".format(version, result.log))
+        return "bad"
+
+    bundle = worker.android_build if worker.platform == "armv7-android" else worker.ios_build
+    env = dict(os.environ, DEFBUILD_BUNDLE=bundle, DEFBUILD_BOB_VERSION=version, DEFBUILD_BOB_SHA=sha)
+    # Same exit codes as git bisect run, 125 means the version can't be tested
+    with trace.span("check {}".format(version), "subprocess", command=options.check):
+        return_code = call(options.check, shell=True, cwd=project.source_directory, env=env)
+    return "good" if return_code == 0 else "skip" if return_code == 125 else "bad"
+
+
+def matrix(options, project_class):
+    """Run every build job of a matrix file on a pool sized after the cores and memory of the machine"""
+    import argparse
+    import configparser
+    import defbuild.bob as _bob
+    import defbuild.cache as _cache
+    import defbuild.catalog as _catalog
+    import defbuild.session as _session
+    from concurrent.futures import ThreadPoolExecutor
+
+    matrix_file = os.path.abspath(options.file)
+    config = configparser.ConfigParser()
+    if not config.read(matrix_file):
+        logging.error("Can not read matrix file {}".format(matrix_file))
+        sys.exit(1)
+    base = os.path.dirname(matrix_file)
+    output = os.path.abspath(options.output) if options.output else os.path.join(
+        os.path.expanduser("~"), ".builder", "cache", "matrix", time.strftime("%Y%m%d-%H%M%S"))
+
+    # Projects are set up one at a time, jobs sharing an options file share its overlay
+    jobs = []
+    for name in config.sections():
+        job = config[name]
+        arguments = argparse.Namespace(
+            project=os.path.join(base, job.get("project", ".")),
+            platform=job.get("platform"),
+            variant=job.get("variant", "debug"),
+            options=os.path.join(base, job["options"]) if job.get("options") else None,
+            distclean=job.getboolean("distclean", fallback=False),
+            no_cache=options.no_cache, report=False, resolve=False, verbose=options.verbose)
+        jobs.append((name, job.get("bob"), project_class(arguments)))
+
+    if any(version for _, version, _ in jobs) and not options.offline:
+        _catalog.offline = False
+    bob_project = _bob.Project(_session.load())
+    shas = {}
+    for name, version, project in jobs:
+        if version:
+            sha = _bob.get_sha_from_version(version) if len(version.split(".")) == 3 else version
+            if not sha:
+                logging.error("Can't find bob version {} for {}".format(version, name))
+                sys.exit(1)
+            shas[version] = sha
+    if _bob.prefetch(bob_project, sorted(set(shas.values())), options.jobs):
+        sys.exit(1)
+
+    for name, version, project in jobs:
+        if version:
+            project.bob = _bob.exists(bob_project, shas[version])
+        if not project.bob:
+            logging.error("Can't find a bob version for {}, download with 'defbuild bob --update'".format(name))
+            sys.exit(1)
+
+    # Hash each source tree once up front, the jobs share the manifest
+    source_hashes = {}
+    for _, _, project in jobs:
+        if not options.no_cache and project.source_directory not in source_hashes:
+            source_hashes[project.source_directory] = _cache.tree_hash(project)
+
+    workers = options.jobs if options.jobs else _matrix_workers(jobs)
+    logging.info("Running {} build jobs with {} parallel workers".format(len(jobs), workers))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(
+            lambda x: _run_job(x[0], x[2], output, source_hashes.get(x[2].source_directory)), jobs))
+
+    logging.info("Matrix summary, results in {}:".format(output))
+    for (name, _, _), result in zip(jobs, results):
+        m, s = divmod(result.duration, 60)
+        logging.info("    {:<30} {:<7} {:.0f}:{:02.0f}".format(
+            name[:30], "cached" if result.cached else "ok" if result.ok else "FAILED", m, s))
+    for _, _, project in jobs:
+        _cache.evict_build_directories(project)
+    if not all(result.ok for result in results):
+        sys.exit(1)
+
+
+def _matrix_workers(jobs):
+    """As many bob processes as the cores and free memory can take"""
+    import re
+    import shlex
+
+    cores = os.cpu_count() or 1
+    # bob uses several threads, give each JVM at least two cores
+    workers = max(1, cores // 2)
+
+    heap = 2 * 1024
+    for x in shlex.split(jobs[0][2].jvm_options or "") if jobs else []:
+        match = re.match(r"-Xmx(\d+)([gGmM])", x)
+        if match:
+            heap = int(match.group(1)) * (1024 if match.group(2) in "gG" else 1)
+    memory = _available_memory()
+    if memory:
+        workers = min(workers, max(1, memory // heap))
+    return min(workers, len(jobs))
+
+
+def _available_memory():
+    """Available memory in MB, None when it can't be found"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES") // 1024 // 1024
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _run_job(name, project, output, source_hash):
+    import defbuild.bob as _bob
+
+    bob_version = _bob.get_version_from_file_name(project.bob)
+    command = _build_command(project, bob_version)
+    if project.distclean:
+        command.extend(["distclean"])
+    command.extend(["build", "bundle"])
+    result = _run_build(project, command, bob_version, source_hash)
+    if not output:
+        return result
+
+    # Collect the bundle and the log of the job in its own folder
+    job_output = os.path.join(output, name)
+    os.makedirs(job_output, exist_ok=True)
+    bundle = project.android_build if project.platform == "armv7-android" else project.ios_build
+    for path in [bundle, result.log]:
+        if path and os.path.exists(path):
+            shutil.copy2(path, job_output)
+    return result
+
+
+def workspace(options, project_class):
+    """Find all projects under a folder and build them in parallel"""
+    import argparse
+    import defbuild.cache as _cache
+    import defbuild.session as _session
+    import defbuild.workspace as _workspace
+    from concurrent.futures import ThreadPoolExecutor
+
+    root = os.path.abspath(options.root)
+    cache_dir = os.path.join(os.path.expanduser("~"), ".builder", "cache")
+    output = _session.load().get("config", "output", fallback=os.path.join(cache_dir, "output"))
+    folders = _workspace.select(root, _workspace.index(cache_dir, root, output, options.refresh), options.filters)
+    if not folders:
+        logging.error("No projects found in {}".format(root))
+        sys.exit(1)
+
+    if options.list:
+        for folder in folders:
+            print(os.path.relpath(folder, root))
+        return
+
+    jobs = []
+    for folder in folders:
+        arguments = argparse.Namespace(project=folder, platform=options.platform, variant=options.variant,
+                                       distclean=options.distclean, no_cache=options.no_cache, report=False,
+                                       resolve=False, verbose=options.verbose)
+        project = project_class(arguments)
+        if not project.bob:
+            logging.error("Can't find a bob version, download with 'defbuild bob --update'")
+            sys.exit(1)
+        if not project.platform:
+            sys.exit(1)
+        source_hash = None if options.no_cache else _cache.tree_hash(project)
+        jobs.append((os.path.relpath(folder, root), project, source_hash))
+
+    workers = options.jobs if options.jobs else _matrix_workers([(name, None, project) for name, project, _ in jobs])
+    logging.info("Building {} projects with {} parallel workers".format(len(jobs), workers))
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda x: _run_job(x[0], x[1], None, x[2]), jobs))
+
+    logging.info("Workspace summary:")
+    for (name, _, _), result in zip(jobs, results):
+        m, s = divmod(result.duration, 60)
+        logging.info("    {:<40} {:<7} {:.0f}:{:02.0f}".format(
+            name[:40], "cached" if result.cached else "ok" if result.ok else "FAILED", m, s))
+    failed = len([x for x in results if not x.ok])
+    m, s = divmod(time.time() - start_time, 60)
+    logging.info("{} passed, {} failed in {:.0f}:{:02.0f}".format(len(results) - failed, failed, m, s))
+    for _, project, _ in jobs:
+        _cache.evict_build_directories(project)
+    if failed:
+        sys.exit(1)
+
+
+def _list_bob(project):
+    import defbuild.bob as _bob
+    import defbuild.catalog as _catalog
+    import defbuild.versions as _versions
+
+    # Listing shouldn't wait for the network to name unknown versions
+    _catalog.offline = True
+    jars = _bob.cached_jars(project)
+    print("    {:<10} {:<42} {:>8}  {}".format("version", "sha1", "size", "last used"))
+    for jar, size, used in jars:
+        current = "*" if os.path.abspath(jar) == os.path.abspath(project.bob) else " "
+        sha = _versions.jar_sha(jar)
+        print("  {} {:<10} {:<42} {:>5.0f} MB  {}".format(
+            current, _bob.get_version_from_sha(sha), sha, size / 1024 / 1024,
+            time.strftime("%Y-%m-%d %H:%M", time.localtime(used))))
+    print("\n{} jars, {:.0f} MB of {} MB, max {} jars".format(
+        len(jars), sum(x[1] for x in jars) / 1024 / 1024, project.max_size, project.max_count))
+
+
+def stats(options):
+    import defbuild.history as _history
+
+    entries = _history.load(options.project)
+    if not entries:
+        logging.info("No builds recorded yet")
+        return
+
+    overall, versions, configurations = _history.stats(entries, options.slowest)
+    print("Builds: {builds}, failed: {failed}, from cache: {cached}".format(**overall))
+    print("Build time p50: {:.1f}s, p95: {:.1f}s\n".format(overall["p50"], overall["p95"]))
+
+    print("By bob version:")
+    print("    {:<14} {:>6} {:>8} {:>8}".format("version", "builds", "p50", "p95"))
+    for version, count, p50, p95 in versions:
+        print("    {:<14} {:>6} {:>7.1f}s {:>7.1f}s".format(version[:14], count, p50, p95))
+
+    print("\nSlowest configurations:")
+    print("    {:<40} {:>6} {:>8} {:>8}".format("configuration", "builds", "p50", "p95"))
+    for name, count, p50, p95 in configurations:
+        print("    {:<40} {:>6} {:>7.1f}s {:>7.1f}s".format(name[:40], count, p50, p95))
+
+
+def listen(project, options):
+    import defbuild.logcat as _logcat
+
+    if project.platform != "armv7-android":
         logging.error("Listening on log not supported for iOS")
         sys.exit(-1)
 
+    devices = [x for x in _connected_devices(project) if x.platform == "armv7-android"]
+    output = options.output
+    if output and os.path.isdir(output):
+        output = os.path.join(output, "{}.log".format(project.name))
+    commands = [(device, device.log_command(options.tag)) for device in devices]
+    tail = _logcat.stream(commands, options.include, options.exclude, options.tail, not options.quiet, output,
+                          options.max_size * 1024 * 1024, options.backups)
+    if options.quiet:
+        sys.stdout.write("".join(tail))
+
 
 def _get_user():
     import getpass
@@ -158,15 +814,31 @@ def _get_user():
 
 
 def resolve(project):
+    import defbuild.bob as _bob
+    import defbuild.jvm as _jvm
+    import defbuild.buildlog as _buildlog
+    import defbuild.libraries as _libraries
+
+    if not project.no_cache and _libraries.restore(project):
+        return
     user, pw = _get_user()
-    command = ["java", "-jar", project.bob, "--email", user, "--auth", pw, "resolve"]
-    os.chdir(project.source_directory)
-    call(command)
+    command = _jvm.command(project) + ["--email", user, "--auth", pw, "resolve"]
+    # The overlay has the merged project file, its dependencies are the ones the libraries are stored under
+    _libraries.prepare(project)
+    os.chdir(project.build_directory)
+    with trace.span("bob resolve", "subprocess", command=_buildlog.masked(command)), _bob.in_use(project.bob):
+        return_code = call(command)
+    _jvm.finish(command)
+    if return_code == 0:
+        _libraries.store(project)
 
 
 def config_set(project, command):
     if hasattr(project, command.key):
         setattr(project, command.key, command.value)
+        if command.key in project.settings:
+            # Settings that can be global or per project are saved where they were asked to go
+            project.settings[command.key] = ("project" if command.local else "config", command.value)
     else:
         logging.error("Attribute doesn't exists")
 
@@ -175,10 +847,16 @@ def print_help():
     print("Usage: builder <command> [<args>]\n")
     print("Some useful commands are:")
     print("    build      Use bob to build a Defold project")
+    print("    matrix     Run all build jobs in a matrix file")
+    print("    workspace  Build all Defold projects found under a folder")
+    print("    watch      Build and install the project every time it changes")
     print("    install    Install a project to a connected device")
     print("    uninstall  Uninstall the Defold project on a connected device")
     print("    bob        Update or set the version of bob that is used")
     print("    config     Update config values, used for setting up iOS Provisional Profiles\n"
           "               and others")
-    print("    resolve    Resolve all external library dependencies\n")
+    print("    resolve    Resolve all external library dependencies")
+    print("    bisect     Find the first bob version where a check fails")
+    print("    stats      Show build time statistics")
+    print("    serve      Run commands sent from other defbuild calls with --daemon\n")
     print("See `builder <command> --help' for information on a specific command.")
@@ -0,0 +1,156 @@
+import os
+import sys
+import time
+import shutil
+import logging
+import subprocess
+import defbuild.trace as trace
+import defbuild.session as session
+
+# The tools can be swapped out, for example with stub scripts when testing
+adb = os.environ.get("DEFBUILD_ADB", "adb")
+idevice_id = os.environ.get("DEFBUILD_IDEVICE_ID", "idevice_id")
+ideviceinstaller = os.environ.get("DEFBUILD_IDEVICEINSTALLER", "ideviceinstaller")
+
+
+class Device:
+    def __init__(self, serial, platform):
+        self.serial = serial
+        self.platform = platform
+
+    def __repr__(self):
+        return "Device({}, {})".format(self.serial, self.platform)
+
+    def install_command(self, bundle):
+        if self.platform == "armv7-android":
+            return [adb, "-s", self.serial, "install", bundle]
+        return [ideviceinstaller, "-u", self.serial, "-i", bundle]
+
+    def uninstall_command(self, package):
+        if self.platform == "armv7-android":
+            return [adb, "-s", self.serial, "uninstall", package]
+        return [ideviceinstaller, "-u", self.serial, "-U", package]
+
+    def list_command(self, package):
+        if self.platform == "armv7-android":
+            return [adb, "-s", self.serial, "shell", "pm", "path", package]
+        return [ideviceinstaller, "-u", self.serial, "-l"]
+
+    def has_package(self, output, package):
+        """Reads the output of list_command"""
+        if self.platform == "armv7-android":
+            return "package:" in output
+        return any(line.split(",")[0].split(" ")[0].strip('"') == package for line in output.splitlines())
+
+    def start_command(self, package):
+        return [adb, "-s", self.serial, "shell", "am", "start", "-n",
+                "{}/com.dynamo.android.DefoldActivity".format(package)]
+
+    def log_command(self, tag):
+        return [adb, "-s", self.serial, "logcat", "-s", tag]
+
+
+class Result:
+    def __init__(self, device, return_code, duration, output):
+        self.device = device
+        self.return_code = return_code
+        self.duration = duration
+        self.output = output
+
+    @property
+    def ok(self):
+        # Older adb versions exit with 0 even if the install failed
+        return self.return_code == 0 and "Failure" not in self.output
+
+
+def installed_hash(device, package):
+    """The hash of the bundle defbuild last installed for package on device"""
+    return session.load_device(device.serial).get(package, "bundle", fallback=None)
+
+
+def record_install(device, package, digest):
+    session.update_device(device.serial, package, {"bundle": digest})
+
+
+def _require(executable):
+    if not shutil.which(executable):
+        logging.error("Can not find dependency {}".format(executable))
+        sys.exit(-1)
+
+
+def _output(command):
+    try:
+        with trace.span(os.path.basename(command[0]), "subprocess", command=" ".join(command)):
+            return subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                  universal_newlines=True).stdout
+    except OSError:
+        return ""
+
+
+def android_devices():
+    _require(adb)
+    devices = []
+    for line in _output([adb, "devices"]).splitlines()[1:]:
+        parts = line.split()
+        # Skip unauthorized and offline devices
+        if len(parts) >= 2 and parts[1] == "device":
+            devices.append(Device(parts[0], "armv7-android"))
+    return devices
+
+
+def ios_devices():
+    _require(idevice_id)
+    return [Device(x.strip(), "armv7-darwin") for x in _output([idevice_id, "-l"]).splitlines() if x.strip()]
+
+
+def connected(platforms, serials=None):
+    """All connected devices of the platforms, optionally only the ones matching serials"""
+    devices = []
+    for platform, tool, find in [("armv7-android", adb, android_devices), ("armv7-darwin", idevice_id, ios_devices)]:
+        if platform not in platforms:
+            continue
+        if len(platforms) > 1 and not shutil.which(tool):
+            # Looking on all platforms, only the ones with tools installed count
+            logging.debug("Can not find {}, skipping {} devices".format(tool, platform))
+            continue
+        devices.extend(find())
+    if serials:
+        devices = [x for x in devices if any(x.serial.startswith(serial) for serial in serials)]
+    return devices
+
+
+def _run(device, command):
+    logging.debug("Using command: '{}'".format(" ".join(command)))
+    start_time = time.time()
+    with trace.span(os.path.basename(command[0]), "subprocess", command=" ".join(command),
+                    device=device.serial) as values:
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        values["return_code"] = process.returncode
+    return Result(device, process.returncode, time.time() - start_time, process.stdout)
+
+
+def run_all(commands, jobs=None):
+    """Run (device, command) pairs concurrently, returns a Result for each in the same order"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    if not commands:
+        return []
+    for executable in set(command[0] for _, command in commands):
+        _require(executable)
+
+    with ThreadPoolExecutor(max_workers=jobs if jobs else len(commands)) as executor:
+        return list(executor.map(lambda x: _run(*x), commands))
+
+
+def report(title, results):
+    logging.info("{} summary:".format(title))
+    logging.info("    {:<28} {:<8} {:<7} {}".format("device", "platform", "result", "time"))
+    for result in results:
+        platform = "android" if result.device.platform == "armv7-android" else "ios"
+        logging.info("    {:<28} {:<8} {:<7} {:.1f}s".format(result.device.serial, platform,
+                                                            "ok" if result.ok else "FAILED", result.duration))
+        if not result.ok:
+            lines = result.output.strip().splitlines()
+            failures = [x for x in lines if "Failure" in x]
+            reason = failures[-1] if failures else lines[-1] if lines else "exit code {}".format(result.return_code)
+            logging.info("        {}".format(reason))
@@ -0,0 +1,29 @@
+import os
+import hashlib
+import threading
+from contextlib import contextmanager
+
+_chunk_size = 1024 * 1024
+
+
+def file_hash(path, algorithm="sha1"):
+    """Hex digest of the file, read in chunks so large bundles are never held in memory"""
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(_chunk_size), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+@contextmanager
+def atomic_write(path, mode="w"):
+    """Yields a temporary file next to path that replaces it when the block finishes, readers never see a half
+    written file. Nothing is replaced if the block raises"""
+    temp = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+    try:
+        with open(temp, mode) as f:
+            yield f
+        os.replace(temp, path)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
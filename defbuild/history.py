@@ -0,0 +1,88 @@
+import os
+import json
+import time
+import logging
+import defbuild.versions as versions
+
+history_file = os.path.join(os.path.expanduser("~"), ".builder", "cache", "history.jsonl")
+
+
+def record(project, result, bob_version, bundle):
+    """Append one build to the history, a line per build so concurrent writers don't clash"""
+    entry = {
+        "time": time.time(),
+        "project": project.name,
+        "platform": result.platform,
+        "variant": project.variant,
+        "bob": versions.jar_sha(project.bob),
+        "bob_version": bob_version,
+        "quick": not project.distclean,
+        "duration": round(result.duration, 3),
+        "return_code": result.return_code,
+        "bundle_size": os.path.getsize(bundle) if bundle and os.path.exists(bundle) else None,
+        "cached": result.cached,
+        "phases": {name: round(duration, 3) for name, duration in result.phases},
+    }
+    os.makedirs(os.path.dirname(history_file), exist_ok=True)
+    try:
+        with open(history_file, "a") as f:
+            f.write(json.dumps(entry, sort_keys=True) + "\n")
+    except OSError as e:
+        logging.warning("Could not save build history: {}".format(e))
+
+
+def load(project=None):
+    entries = []
+    if not os.path.exists(history_file):
+        return entries
+    with open(history_file, "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash, skip it
+                continue
+            if project is None or entry.get("project") == project:
+                entries.append(entry)
+    return entries
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    if not values:
+        return 0
+    index = (len(values) - 1) * percent / 100
+    lower = int(index)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (index - lower)
+
+
+def configuration(entry):
+    return "{} {} {} {}".format(entry["project"], entry["platform"], entry["variant"],
+                                "quick" if entry["quick"] else "full")
+
+
+def stats(entries, slowest=5):
+    """Summaries of the successful, not cached builds, returns (overall, by bob version, slowest configurations)"""
+    builds = [x for x in entries if x.get("return_code") == 0 and not x.get("cached")]
+    durations = [x["duration"] for x in builds]
+    overall = {
+        "builds": len(entries),
+        "failed": len([x for x in entries if x.get("return_code") != 0]),
+        "cached": len([x for x in entries if x.get("cached")]),
+        "p50": percentile(durations, 50),
+        "p95": percentile(durations, 95),
+    }
+
+    by_version = {}
+    for entry in builds:
+        by_version.setdefault(entry.get("bob_version") or entry["bob"], []).append(entry["duration"])
+    bob_versions = [(version, len(values), percentile(values, 50), percentile(values, 95))
+                    for version, values in sorted(by_version.items(), key=lambda x: versions.version_key(x[0]))]
+
+    by_configuration = {}
+    for entry in builds:
+        by_configuration.setdefault(configuration(entry), []).append(entry["duration"])
+    configurations = sorted(((name, len(values), percentile(values, 50), percentile(values, 95))
+                             for name, values in by_configuration.items()), key=lambda x: x[3], reverse=True)
+    return overall, bob_versions, configurations[:slowest]
@@ -0,0 +1,89 @@
+import os
+import re
+import shlex
+import shutil
+import logging
+import itertools
+import subprocess
+import defbuild.trace as trace
+import defbuild.session as session
+
+# Dynamic AppCDS archives (-XX:ArchiveClassesAtExit) need JDK 13
+_cds_java_version = 13
+_dump = "-XX:ArchiveClassesAtExit="
+_counter = itertools.count()
+
+
+def _java():
+    """(major version, full version) of the java on the path, remembered in the session until java changes"""
+    java = shutil.which("java")
+    if not java:
+        return None, None
+    java = os.path.realpath(java)
+    key = "{}|{}".format(java, os.path.getmtime(java))
+
+    config = session.load()
+    cached = config.get("config", "java", fallback="").rsplit("|", 2)
+    if len(cached) == 3 and cached[0] == key:
+        return int(cached[1]), cached[2]
+
+    try:
+        with trace.span("java -version", "subprocess", command=java):
+            output = subprocess.run([java, "-version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    universal_newlines=True).stdout
+    except OSError:
+        return None, None
+    match = re.search(r'version "((\d+)(?:\.(\d+))?[^"]*)"', output)
+    if not match:
+        return None, None
+    # Before 9 versions looked like 1.8.0
+    major = int(match.group(3)) if match.group(2) == "1" and match.group(3) else int(match.group(2))
+    full = re.sub(r"[^\w.-]", "_", match.group(1))
+    session.update({"java": "{}|{}|{}".format(key, major, full)})
+    return major, full
+
+
+def java_version():
+    """Major version of the java on the path"""
+    return _java()[0]
+
+
+def archive(bob):
+    # An archive only works with the exact java that dumped it, a new java gets its own archive
+    return "{}_java{}.jsa".format(os.path.splitext(bob)[0], _java()[1])
+
+
+def _archive_temp(bob):
+    # Unique per command so parallel builds don't dump into the same file
+    return "{}.{}.{}.tmp".format(archive(bob), os.getpid(), next(_counter))
+
+
+def command(project):
+    """The start of the java command line for bob, with the configured options and the class data archive"""
+    arguments = ["java"] + shlex.split(project.jvm_options or "")
+    if str(project.cds).lower() in ["false", "no", "off", "0"]:
+        return arguments + ["-jar", project.bob]
+
+    version = java_version()
+    if version is None or version < _cds_java_version:
+        logging.debug("Java {} can't use a class data archive".format(version))
+        return arguments + ["-jar", project.bob]
+
+    if os.path.exists(archive(project.bob)):
+        arguments.extend(["-XX:SharedArchiveFile={}".format(archive(project.bob)), "-Xshare:auto"])
+    else:
+        logging.info("Creating class data archive for {}".format(os.path.basename(project.bob)))
+        arguments.append("{}{}".format(_dump, _archive_temp(project.bob)))
+    return arguments + ["-jar", project.bob]
+
+
+def finish(command):
+    """Move an archive dumped by a finished bob command into place"""
+    temps = [x[len(_dump):] for x in command if x.startswith(_dump)]
+    if not temps or not os.path.exists(temps[0]):
+        return
+    target = temps[0][:temps[0].rfind(".jsa.") + len(".jsa")]
+    if os.path.exists(target):
+        os.remove(temps[0])
+    else:
+        os.replace(temps[0], target)
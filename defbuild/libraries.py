@@ -0,0 +1,122 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import configparser
+import defbuild.files as files
+import defbuild.trace as trace
+
+
+def _cache_root(project):
+    return os.path.join(project.cache_dir, "libraries")
+
+
+def library_directory(project):
+    # Overlays link .internal to the source tree, so this is where bob puts them in both cases
+    return os.path.join(project.source_directory, ".internal", "lib")
+
+
+def prepare(project):
+    """Create the library folder before bob resolves, only done when resolving so builds leave the source tree alone"""
+    directory = library_directory(project)
+    os.makedirs(directory, exist_ok=True)
+    link = os.path.join(project.build_directory, ".internal")
+    if not os.path.lexists(link):
+        try:
+            os.symlink(os.path.dirname(directory), link, target_is_directory=True)
+        except OSError:
+            # Linked by another build, or no symlink support and the next overlay sync copies it
+            pass
+
+
+def dependencies(project_file):
+    """The dependency urls of the project, both the 'dependencies = a,b' and the 'dependencies#0 = a' form"""
+    config = configparser.ConfigParser()
+    config.read(project_file)
+    if not config.has_section("project"):
+        return []
+    urls = []
+    for key, value in config.items("project"):
+        if key == "dependencies" or key.startswith("dependencies#"):
+            urls.extend(x.strip() for x in value.split(",") if x.strip())
+    return urls
+
+
+def dependency_hash(urls):
+    sha1 = hashlib.sha1()
+    for url in urls:
+        sha1.update("{}\n".format(url).encode("utf-8"))
+    return sha1.hexdigest()
+
+
+def _set_path(project, key):
+    return os.path.join(_cache_root(project), "sets", "{}.json".format(key))
+
+
+def _blob_path(project, digest):
+    return os.path.join(_cache_root(project), "blobs", digest[:2], "{}.zip".format(digest))
+
+
+def _copy(source, target):
+    with open(source, "rb") as f, files.atomic_write(target, "wb") as fp:
+        shutil.copyfileobj(f, fp)
+
+
+def _load_set(project, key):
+    try:
+        with open(_set_path(project, key), "r") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+@trace.traced("cache")
+def restore(project):
+    """Fill the library folder from the cache, returns False if the dependencies were never resolved before"""
+    urls = dependencies(project.project_file)
+    libraries = _load_set(project, dependency_hash(urls)) if urls else {}
+    if libraries is None or not all(os.path.exists(_blob_path(project, x)) for x in libraries.values()):
+        return False
+
+    directory = library_directory(project)
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith(".zip") and name not in libraries:
+            os.remove(os.path.join(directory, name))
+    for name, digest in libraries.items():
+        target = os.path.join(directory, name)
+        blob = _blob_path(project, digest)
+        if os.path.exists(target) and os.path.getsize(target) == os.path.getsize(blob) and \
+                files.file_hash(target) == digest:
+            continue
+        # Copied, not linked, so bob can never write into the cache
+        _copy(blob, target)
+    logging.info("Using {} cached libraries, dependencies are unchanged".format(len(libraries)))
+    return True
+
+
+@trace.traced("cache")
+def store(project):
+    """Add the libraries bob resolved to the cache"""
+    urls = dependencies(project.project_file)
+    directory = library_directory(project)
+    if not urls or not os.path.isdir(directory):
+        return
+
+    libraries = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".zip"):
+            continue
+        path = os.path.join(directory, name)
+        digest = files.file_hash(path)
+        blob = _blob_path(project, digest)
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            _copy(path, blob)
+        libraries[name] = digest
+
+    path = _set_path(project, dependency_hash(urls))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with files.atomic_write(path) as fp:
+        json.dump(libraries, fp, sort_keys=True)
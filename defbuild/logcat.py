@@ -0,0 +1,145 @@
+import os
+import re
+import sys
+import asyncio
+import logging
+import collections
+import defbuild.trace as trace
+
+# Lines waiting to be written, readers only wait when the writer is this far behind
+_queue_size = 10000
+_batch_size = 500
+# Longest line that is read in one piece
+_line_limit = 1024 * 1024
+
+
+class _RotatingFile:
+    """A log file that is moved to name.1, name.2 and so on when it grows past max_bytes"""
+
+    def __init__(self, path, max_bytes, backups):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+        self.size = self.file.tell()
+
+    def write(self, text):
+        if self.max_bytes and self.size and self.size + len(text) > self.max_bytes:
+            self._rotate()
+        self.file.write(text)
+        self.size += len(text)
+
+    def _rotate(self):
+        self.file.close()
+        for index in range(self.backups - 1, 0, -1):
+            source = "{}.{}".format(self.path, index)
+            if os.path.exists(source):
+                os.replace(source, "{}.{}".format(self.path, index + 1))
+        if self.backups:
+            os.replace(self.path, "{}.1".format(self.path))
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, "w", encoding="utf-8")
+        self.size = 0
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class Filter:
+    def __init__(self, include=None, exclude=None):
+        self.include = [re.compile(x) for x in include or []]
+        self.exclude = [re.compile(x) for x in exclude or []]
+
+    def match(self, line):
+        if self.include and not any(x.search(line) for x in self.include):
+            return False
+        return not any(x.search(line) for x in self.exclude)
+
+
+async def _read(device, command, line_filter, queue):
+    process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.STDOUT, limit=_line_limit)
+    prefix = "[{}] ".format(device.serial)
+    start = trace.now()
+    try:
+        async for raw in process.stdout:
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            if line_filter.match(line):
+                await queue.put(prefix + line + "\n")
+    except asyncio.CancelledError:
+        if process.returncode is None:
+            process.kill()
+        raise
+    finally:
+        await process.wait()
+        # The readers overlap on the event loop thread, each gets its own row
+        trace.add(os.path.basename(command[0]), "subprocess", start, trace.now() - start,
+                  {"command": " ".join(command), "return_code": process.returncode},
+                  lane="logcat {}".format(device.serial))
+    logging.info("Stopped listening to {}".format(device.serial))
+
+
+async def _write(queue, tail, echo, log_file):
+    loop = asyncio.get_event_loop()
+    while True:
+        lines = [await queue.get()]
+        if lines[0] is None:
+            return
+        # Take whatever else is waiting so a fast stream is written in few, large chunks
+        while len(lines) < _batch_size and not queue.empty():
+            lines.append(queue.get_nowait())
+        done = lines[-1] is None
+        if done:
+            lines.pop()
+        tail.extend(lines)
+        text = "".join(lines)
+        if echo:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        if log_file:
+            # The file is written on another thread so a slow disk doesn't stop the event loop
+            await loop.run_in_executor(None, _write_file, log_file, text)
+        if done:
+            return
+
+
+def _write_file(log_file, text):
+    log_file.write(text)
+    log_file.flush()
+
+
+async def _listen(commands, line_filter, tail, echo, log_file):
+    queue = asyncio.Queue(_queue_size)
+    writer = asyncio.ensure_future(_write(queue, tail, echo, log_file))
+    readers = [_read(device, command, line_filter, queue) for device, command in commands]
+    try:
+        await asyncio.gather(*readers)
+    finally:
+        await queue.put(None)
+        await writer
+
+
+def stream(commands, include=None, exclude=None, tail_lines=1000, echo=True, output=None, max_bytes=0, backups=5):
+    """Read the log commands of all devices at once, returns the last tail_lines lines that passed the filters"""
+    line_filter = Filter(include, exclude)
+    tail = collections.deque(maxlen=tail_lines)
+    log_file = _RotatingFile(output, max_bytes, backups) if output else None
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    main = loop.create_task(_listen(commands, line_filter, tail, echo, log_file))
+    try:
+        loop.run_until_complete(main)
+    except KeyboardInterrupt:
+        # Let the readers stop their processes and the writer empty the queue
+        main.cancel()
+        loop.run_until_complete(asyncio.gather(main, return_exceptions=True))
+    finally:
+        loop.close()
+        if log_file:
+            log_file.close()
+    return list(tail)
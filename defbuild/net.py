@@ -0,0 +1,27 @@
+import threading
+import requests
+import defbuild.trace as trace
+
+_max_connections = 16
+_session = None
+_lock = threading.Lock()
+
+
+class _Session(requests.Session):
+    def request(self, method, url, *args, **kwargs):
+        with trace.span("{} {}".format(method, url), "network", url=url) as values:
+            response = super().request(method, url, *args, **kwargs)
+            values["status"] = response.status_code
+            return response
+
+
+def session():
+    """One requests session for the process, so connections to the same server are kept open and reused"""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = _Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=_max_connections)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+    return _session
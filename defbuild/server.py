@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import heapq
+import socket
+import logging
+import itertools
+import threading
+import traceback
+
+socket_path = os.environ.get("DEFBUILD_SOCKET",
+                             os.path.join(os.path.expanduser("~"), ".builder", "cache", "defbuild.sock"))
+
+# The commands the daemon runs, lower priority numbers are started first
+priorities = {"start": 0, "install": 1, "uninstall": 1, "resolve": 2, "config": 2, "bob": 2, "build": 3}
+
+# Sent before the exit code, after the output of the command
+_exit_marker = b"\0"
+
+
+class _Scheduler:
+    """Runs the most important request first, one at a time per project and up to workers at once"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.condition = threading.Condition()
+        self.pending = []
+        self.busy = set()
+        self.counter = itertools.count()
+
+    def _next(self):
+        if len(self.busy) >= self.workers:
+            return None
+        for entry in sorted(self.pending):
+            if entry[2] not in self.busy:
+                return entry
+        return None
+
+    def acquire(self, key, priority):
+        with self.condition:
+            entry = (priority, next(self.counter), key)
+            heapq.heappush(self.pending, entry)
+            while self._next() != entry:
+                self.condition.wait()
+            self.pending.remove(entry)
+            heapq.heapify(self.pending)
+            self.busy.add(key)
+
+    def release(self, key):
+        with self.condition:
+            self.busy.discard(key)
+            self.condition.notify_all()
+
+
+def _request_key(options, cwd):
+    """Requests with the same key never run at the same time"""
+    if options.command in ["bob", "config"]:
+        # Both change the session
+        return "session"
+    return os.path.realpath(os.path.join(cwd, getattr(options, "project", None) or "."))
+
+
+def _preload(options, key):
+    """Read what the request will need into this process, the command is forked from it and finds it there"""
+    import defbuild.catalog as catalog
+    import defbuild.session as session
+
+    catalog.offline = True
+    try:
+        catalog.preload()
+    except ValueError:
+        logging.debug("Could not read the version catalog")
+    session.load()
+    if key == "session" or not os.path.isdir(key):
+        return
+    project_files = [x for x in os.listdir(key) if x.endswith(".project")]
+    if project_files:
+        game_config = session.read(os.path.join(key, project_files[0]))
+        name = game_config.get("project", "title", fallback=None)
+        if name:
+            session.load_project(name)
+
+
+def _receive_request(connection):
+    data = b""
+    while not data.endswith(b"\n"):
+        # One byte at a time so nothing of the forwarded input after the request is read here
+        chunk = connection.recv(1)
+        if not chunk:
+            return None
+        data += chunk
+    return json.loads(data.decode("utf-8"))
+
+
+def _run_child(connection, listener, request, run):
+    """Runs in the forked process, the connection becomes stdin, stdout and stderr"""
+    code = 1
+    try:
+        listener.close()
+        for fd in [0, 1, 2]:
+            os.dup2(connection.fileno(), fd)
+        os.chdir(request["cwd"])
+        try:
+            run(request["argv"])
+            code = 0
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 0 if e.code is None else 1
+        except KeyboardInterrupt:
+            code = 130
+        except BaseException:
+            traceback.print_exc()
+        sys.stdout.flush()
+        sys.stderr.flush()
+    finally:
+        os._exit(code & 0xff)
+
+
+def _handle(connection, listener, scheduler, parse, run):
+    with connection:
+        request = _receive_request(connection)
+        if request is None:
+            return
+        options = parse(request["argv"])
+        key = _request_key(options, request["cwd"])
+        priority = request.get("priority")
+        priority = priorities.get(options.command, 3) if priority is None else priority
+        logging.info("Queued '{}' for {}".format(" ".join(request["argv"]), key))
+
+        scheduler.acquire(key, priority)
+        try:
+            _preload(options, key)
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                _run_child(connection, listener, request, run)
+            _, status = os.waitpid(pid, 0)
+        finally:
+            scheduler.release(key)
+
+        code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1
+        logging.info("Finished '{}' with exit code {}".format(" ".join(request["argv"]), code))
+        try:
+            connection.sendall(_exit_marker + "{}\n".format(code).encode("utf-8"))
+        except OSError:
+            # The client is gone
+            pass
+
+
+def _running():
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        client.close()
+
+
+def serve(workers, parse, run):
+    """Accept commands on the socket until stopped, parse and run are the argument parser and runner of the cli"""
+    if not hasattr(socket, "AF_UNIX") or not hasattr(os, "fork"):
+        logging.error("serve needs unix sockets and fork, it is not supported on this platform")
+        sys.exit(1)
+    if _running():
+        logging.error("defbuild is already serving on {}".format(socket_path))
+        sys.exit(1)
+    if os.path.exists(socket_path):
+        # Left behind by a daemon that didn't stop cleanly
+        os.remove(socket_path)
+
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    listener.listen(16)
+    scheduler = _Scheduler(workers)
+    logging.info("Serving on {} with {} workers, stop with Ctrl+C".format(socket_path, workers))
+    try:
+        while True:
+            connection, _ = listener.accept()
+            threading.Thread(target=_handle, args=(connection, listener, scheduler, parse, run), daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        os.remove(socket_path)
+
+
+def _forward_input(client):
+    try:
+        for line in sys.stdin:
+            client.sendall(line.encode("utf-8"))
+        client.shutdown(socket.SHUT_WR)
+    except (OSError, ValueError):
+        pass
+
+
+def send(argv, priority=None):
+    """Run the command in a running daemon, returns its exit code or None if no daemon is running"""
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(socket_path):
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except OSError:
+        client.close()
+        return None
+
+    with client:
+        request = {"argv": argv, "cwd": os.getcwd(), "priority": priority}
+        client.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        threading.Thread(target=_forward_input, args=(client,), daemon=True).start()
+
+        output = sys.stdout.buffer
+        tail = b""
+        while not tail.endswith(b"\n"):
+            # Commands forked at the same time can hold the connection open, so stop at the exit code, not at EOF
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            if tail:
+                tail += chunk
+                continue
+            marker = chunk.find(_exit_marker)
+            if marker >= 0:
+                output.write(chunk[:marker])
+                tail = chunk[marker:]
+            else:
+                output.write(chunk)
+            output.flush()
+        output.flush()
+    if tail.startswith(_exit_marker) and tail[1:].strip().isdigit():
+        return int(tail[1:].strip())
+    logging.error("The defbuild daemon stopped before the command finished")
+    return 1
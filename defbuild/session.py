@@ -0,0 +1,153 @@
+import os
+import re
+import hashlib
+import logging
+import configparser
+import defbuild.files as files
+import defbuild.trace as trace
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+cache_dir = os.path.join(os.path.expanduser("~"), ".builder", "cache")
+session_file = os.path.join(cache_dir, "session")
+_project_dir = os.path.join(cache_dir, "projects")
+_device_dir = os.path.join(cache_dir, "devices")
+
+# Parsed files by path, reused while the file on disk is the same
+_parsed = {}
+
+
+@contextmanager
+def locked(path, shared=False, blocking=True):
+    """Hold a lock on path.lock, exclusive by default to serialize writers across processes. Yields False if
+    blocking is off and someone else has the lock"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open("{}.lock".format(path), "a+") as lock:
+        try:
+            if fcntl:
+                flags = (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB)
+                fcntl.flock(lock.fileno(), flags)
+            elif not shared:
+                # Windows has no shared locks, files that are in use can't be removed there anyway
+                lock.seek(0)
+                msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+        except OSError:
+            if blocking:
+                raise
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            if fcntl:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+            elif not shared:
+                lock.seek(0)
+                msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@trace.traced("config")
+def _read(path):
+    config = configparser.ConfigParser()
+    config.read(path)
+    return config
+
+
+def read(path):
+    """Parse an ini file, a file that hasn't changed since the last call isn't parsed again. Don't modify the result"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return _read(path)
+    # Files are replaced, not written in place, so a new inode means new content
+    stamp = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    cached = _parsed.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    config = _read(path)
+    _parsed[path] = (stamp, config)
+    return config
+
+
+def _write(path, config):
+    with files.atomic_write(path) as f:
+        config.write(f)
+
+
+def _record_file(directory, name):
+    safe_name = re.sub(r"[^\w.-]", "_", name)
+    return os.path.join(directory, "{}_{}".format(safe_name, hashlib.sha1(name.encode("utf-8")).hexdigest()[:8]))
+
+
+def _project_file(name):
+    return _record_file(_project_dir, name)
+
+
+def _update(path, section, values):
+    with locked(path):
+        # Re-read under the lock so changes from other processes are kept
+        config = _read(path)
+        if not config.has_section(section):
+            config.add_section(section)
+
+        changed = False
+        for key, value in values.items():
+            if value is None:
+                continue
+            if config.get(section, key, raw=True, fallback=None) != value:
+                config.set(section, key, value)
+                changed = True
+
+        if changed:
+            logging.debug("Saving {} to {}".format(", ".join(sorted(values)), path))
+            _write(path, config)
+
+
+def load():
+    """The global session config, always has a 'config' section"""
+    config = read(session_file)
+    if not config.has_section("config"):
+        config.add_section("config")
+    return config
+
+
+def load_project(name):
+    """The record of a project, sessions from older versions stored it as a section in the session file"""
+    path = _project_file(name)
+    if os.path.exists(path):
+        return read(path)
+
+    config = configparser.ConfigParser()
+    legacy = read(session_file)
+    if legacy.has_section(name):
+        config.read_dict({name: dict(legacy.items(name, raw=True))})
+    return config
+
+
+def update(values):
+    """Update keys in the global 'config' section, only writes if a value changed"""
+    _update(session_file, "config", values)
+
+
+def update_project(name, values):
+    """Update keys in the record of a project, only writes if a value changed"""
+    if not os.path.exists(_project_file(name)):
+        # Carry over what an older session had stored about the project
+        legacy = load_project(name)
+        if legacy.has_section(name):
+            values = dict(legacy.items(name, raw=True), **{k: v for k, v in values.items() if v is not None})
+    _update(_project_file(name), name, values)
+
+
+def load_device(serial):
+    """What defbuild has installed on a device, a section per package"""
+    return read(_record_file(_device_dir, serial))
+
+
+def update_device(serial, package, values):
+    _update(_record_file(_device_dir, serial), package, values)
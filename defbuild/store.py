@@ -0,0 +1,189 @@
+import os
+import socket
+import hashlib
+import logging
+import defbuild.files as files
+import defbuild.trace as trace
+
+# Set artifact_store to a folder shared by the build machines or to the url of a server that takes PUT and GET.
+# Every bundle is stored as <key>/<bundle name> with a <bundle name>.sha256 next to it to check it against.
+_chunk_size = 1024 * 1024
+_timeout = 30
+
+
+class StoreError(Exception):
+    pass
+
+
+def _copy(source, target):
+    """Copy between file objects, returns the sha256 of what was copied"""
+    sha256 = hashlib.sha256()
+    for data in iter(lambda: source.read(_chunk_size), b""):
+        sha256.update(data)
+        target.write(data)
+    return sha256.hexdigest()
+
+
+class FileStore:
+    def __init__(self, root):
+        self.root = root
+
+    def __repr__(self):
+        return self.root
+
+    def _path(self, key, name):
+        return os.path.join(self.root, key[:2], key, name)
+
+    def get(self, key, name, target):
+        """Copy the artifact to the open file target, returns False if the store doesn't have it"""
+        path = self._path(key, name)
+        if not os.path.exists(path + ".sha256"):
+            return False
+        with open(path + ".sha256", "r") as f:
+            expected = f.read().strip()
+        with open(path, "rb") as source:
+            if _copy(source, target) != expected:
+                raise StoreError("{} doesn't match its checksum".format(path))
+        return True
+
+    def put(self, key, name, path, digest):
+        target = self._path(key, name)
+        if os.path.exists(target + ".sha256"):
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # The folder is shared, so temporary names are unique per machine and process
+        suffix = ".{}.{}.tmp".format(socket.gethostname(), os.getpid())
+        with open(path, "rb") as source, open(target + suffix, "wb") as f:
+            copied = _copy(source, f)
+        if copied != digest:
+            os.remove(target + suffix)
+            raise StoreError("{} changed while it was uploaded".format(path))
+        os.replace(target + suffix, target)
+        # Written last, other machines only use the artifact once its checksum is there
+        with open(target + ".sha256" + suffix, "w") as f:
+            f.write(digest)
+        os.replace(target + ".sha256" + suffix, target + ".sha256")
+
+
+class _HashingReader:
+    """Hashes a file while requests streams it"""
+
+    def __init__(self, f, size):
+        self.f = f
+        self.size = size
+        self.sha256 = hashlib.sha256()
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter(lambda: self.read(_chunk_size), b"")
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.sha256.update(data)
+        return data
+
+
+class HttpStore:
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def __repr__(self):
+        return self.url
+
+    def _url(self, key, name):
+        return "{}/{}/{}/{}".format(self.url, key[:2], key, name)
+
+    def get(self, key, name, target):
+        import requests
+        import defbuild.net as net
+
+        url = self._url(key, name)
+        try:
+            response = net.session().get(url + ".sha256", timeout=_timeout)
+            if response.status_code == 404:
+                return False
+            response.raise_for_status()
+            expected = response.text.strip()
+            with net.session().get(url, stream=True, timeout=_timeout) as response:
+                response.raise_for_status()
+                sha256 = hashlib.sha256()
+                for data in response.iter_content(_chunk_size):
+                    sha256.update(data)
+                    target.write(data)
+        except requests.RequestException as e:
+            raise StoreError(str(e))
+        if sha256.hexdigest() != expected:
+            raise StoreError("{} doesn't match its checksum".format(url))
+        return True
+
+    def put(self, key, name, path, digest):
+        import requests
+        import defbuild.net as net
+
+        url = self._url(key, name)
+        try:
+            if net.session().head(url + ".sha256", timeout=_timeout).status_code == 200:
+                return
+            with open(path, "rb") as f:
+                # Sent in chunks, the bundle is never read into memory
+                reader = _HashingReader(f, os.path.getsize(path))
+                net.session().put(url, data=reader, timeout=_timeout).raise_for_status()
+            if reader.sha256.hexdigest() != digest:
+                raise StoreError("{} changed while it was uploaded".format(path))
+            net.session().put(url + ".sha256", data=digest.encode("utf-8"), timeout=_timeout).raise_for_status()
+        except requests.RequestException as e:
+            raise StoreError(str(e))
+
+
+# Store classes by url scheme, anything without a known scheme is a folder
+backends = {"http": HttpStore, "https": HttpStore}
+
+
+def open_store(location):
+    if not location:
+        return None
+    scheme = location.split("://", 1)[0] if "://" in location else None
+    if scheme in backends:
+        return backends[scheme](location)
+    if scheme == "file":
+        location = location[len("file://"):]
+    return FileStore(os.path.abspath(os.path.expanduser(location)))
+
+
+@trace.traced("store")
+def download(store, key, target):
+    """Fetch the artifact for key into the file target, returns True if the store had it"""
+    temp = "{}.{}.tmp".format(target, os.getpid())
+    directory = os.path.dirname(target)
+    created = not os.path.isdir(directory)
+    os.makedirs(directory, exist_ok=True)
+    found = False
+    try:
+        with open(temp, "wb") as f:
+            found = store.get(key, os.path.basename(target), f)
+        if found:
+            os.replace(temp, target)
+        return found
+    except (StoreError, OSError) as e:
+        logging.warning("Could not download {} from {}: {}".format(key, store, e))
+        return False
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+        if created and not found:
+            # Leave no empty folder behind, the local cache takes a folder as a cached build
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+
+
+@trace.traced("store")
+def upload(store, key, path):
+    """Share the artifact, a failed upload only logs a warning"""
+    try:
+        store.put(key, os.path.basename(path), path, files.file_hash(path, "sha256"))
+    except (StoreError, OSError) as e:
+        logging.warning("Could not upload {} to {}: {}".format(key, store, e))
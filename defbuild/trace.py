@@ -0,0 +1,83 @@
+import os
+import json
+import time
+import zlib
+import functools
+import threading
+from contextlib import contextmanager
+
+# Events in the Chrome trace event format, open the written file in chrome://tracing or https://ui.perfetto.dev
+_events = None
+_threads = {}
+_lock = threading.Lock()
+_start = 0
+
+
+def enabled():
+    return _events is not None
+
+
+def enable():
+    global _events, _start
+    _events = []
+    _start = now()
+
+
+def now():
+    """Microseconds on the clock the events use"""
+    return time.perf_counter() * 1000000
+
+
+def add(name, category, start, duration, args=None, lane=None):
+    """Record a finished event, lane puts it on its own row instead of the row of the current thread"""
+    if _events is None:
+        return
+    if lane:
+        tid = zlib.crc32(lane.encode("utf-8"))
+    else:
+        tid = threading.get_ident()
+        lane = threading.current_thread().name
+    event = {"name": name, "cat": category, "ph": "X", "pid": os.getpid(), "tid": tid,
+             "ts": round(start - _start, 1), "dur": round(duration, 1), "args": args or {}}
+    with _lock:
+        _events.append(event)
+        _threads[tid] = lane
+
+
+@contextmanager
+def span(name, category, **args):
+    """Record how long the block takes, yields the args so results can be added to them"""
+    if _events is None:
+        yield args
+        return
+    start = now()
+    try:
+        yield args
+    finally:
+        add(name, category, start, now() - start, args)
+
+
+def traced(category):
+    """Decorator that records every call of the function, with its plain arguments"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _events is None:
+                return function(*args, **kwargs)
+            values = [x for x in list(args) + list(kwargs.values()) if isinstance(x, (str, int, float))]
+            name = "{}.{}".format(function.__module__.split(".")[-1], function.__qualname__)
+            with span(name, category, arguments=values):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def write(path):
+    with _lock:
+        events = list(_events)
+        events.extend({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                      for tid, name in _threads.items())
+    events.append({"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": "defbuild"}})
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
@@ -1,6 +1,6 @@
-import requests
 import json
 import os
+import defbuild.trace as trace
 from html.parser import HTMLParser
 
 _url = "http://d.defold.com/stable/"
@@ -29,15 +29,33 @@ class _UpdateVersionJSON(HTMLParser):
                 json.dump(new, fp, indent=4, sort_keys=True)
 
 
-def update():
-    response = requests.get(_url)
-    if response.status_code in [200]:
+def fetch(url, etag=None, last_modified=None):
+    """Conditional GET, returns None when the server says our cached copy is still current"""
+    import defbuild.net as net
+
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    response = net.session().get(url, headers=headers, timeout=10)
+    if response.status_code == 304:
+        return None
+    return response
+
+
+def update(etag=None, last_modified=None):
+    response = fetch(_url, etag, last_modified)
+    if response is not None and response.status_code in [200]:
         parser = _UpdateVersionJSON()
         parser.feed(str(response.content))
+    return response
 
 
 def latest():
-    response = requests.get(_latest)
+    import defbuild.net as net
+
+    response = net.session().get(_latest)
     if response.status_code in [200]:
         return response.json()["version"]
 
@@ -54,10 +72,24 @@ def update_required():
 
 
 def beta():
-    beta_info = requests.get(_beta).json()
+    import defbuild.net as net
+
+    beta_info = net.session().get(_beta).json()
     return beta_info["sha1"], beta_info["version"]
 
 
+def version_key(version):
+    """Sorts versions like 1.2.9 before 1.2.10, anything that isn't a release version sorts first"""
+    parts = version.split(".")
+    return tuple(int(x) for x in parts) if all(x.isdigit() for x in parts) else ()
+
+
+def jar_sha(jar):
+    """The sha1 of the bob version in a cached jar path, bob_<sha1>.jar"""
+    return os.path.basename(jar).replace(".jar", "").split("bob_")[-1]
+
+
+@trace.traced("version")
 def get(auto_update=False):
     version_data = {}
     if os.path.exists(version_json):
@@ -0,0 +1,69 @@
+import os
+import json
+import fnmatch
+import hashlib
+import logging
+import defbuild.files as files
+
+_skip_directories = [".git", ".internal", "build", "node_modules"]
+
+
+def _index_file(cache_dir, root):
+    name = hashlib.sha1(root.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, "workspaces", "{}.json".format(name))
+
+
+def _scan(root, output):
+    """Walk the tree for folders with a .project file, project folders themselves are not searched further"""
+    projects = []
+    directories = {}
+    for path, dirs, names in os.walk(root):
+        directories[path] = os.stat(path).st_mtime_ns
+        if any(x.endswith(".project") for x in names):
+            projects.append(path)
+            dirs[:] = []
+            continue
+        dirs[:] = sorted(x for x in dirs if x not in _skip_directories and not x.startswith(".") and
+                         os.path.join(path, x) != output)
+    return projects, directories
+
+
+def _valid(directories):
+    # Adding or removing anything in a folder changes its mtime, so unchanged folders mean an unchanged index
+    for path, mtime in directories.items():
+        try:
+            if os.stat(path).st_mtime_ns != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def index(cache_dir, root, output, refresh=False):
+    """All project folders under root, the result is cached until a searched folder changes"""
+    root = os.path.abspath(root)
+    path = _index_file(cache_dir, root)
+    if not refresh and os.path.exists(path):
+        try:
+            with open(path, "r") as fp:
+                cached = json.load(fp)
+            if _valid(cached["directories"]):
+                return cached["projects"]
+        except (ValueError, KeyError):
+            pass
+
+    logging.info("Indexing projects in {}".format(root))
+    projects, directories = _scan(root, os.path.abspath(output))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with files.atomic_write(path) as fp:
+        json.dump({"projects": projects, "directories": directories}, fp)
+    return projects
+
+
+def select(root, projects, patterns):
+    """Projects whose path relative to root matches any of the patterns, all of them without patterns"""
+    if not patterns:
+        return projects
+    root = os.path.abspath(root)
+    return [x for x in projects
+            if any(fnmatch.fnmatch(os.path.relpath(x, root).replace(os.sep, "/"), pattern) for pattern in patterns)]
@@ -0,0 +1,74 @@
+import os
+import shutil
+import zipfile
+import tempfile
+import unittest
+import functools
+import threading
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+import defbuild.bob as bob
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class ArchiveDownloadTest(unittest.TestCase):
+    """Downloads bob from a local stand-in for DEFBUILD_ARCHIVE_URL"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.archive = os.path.join(self.root, "archive")
+        self.cache = os.path.join(self.root, "cache")
+        handler = functools.partial(_QuietHandler, directory=self.archive)
+        self.server = HTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.archive_url = bob.archive_url
+        bob.archive_url = "http://127.0.0.1:{}".format(self.server.server_port)
+
+    def tearDown(self):
+        bob.archive_url = self.archive_url
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root)
+
+    def _publish(self, sha, data=None):
+        path = os.path.join(self.archive, sha, "bob", "bob.jar")
+        os.makedirs(os.path.dirname(path))
+        if data is None:
+            with zipfile.ZipFile(path, "w") as jar:
+                jar.writestr("META-INF/MANIFEST.MF", "Main-Class: com.dynamo.bob.Bob\n")
+        else:
+            with open(path, "wb") as f:
+                f.write(data)
+        return path
+
+    def test_download(self):
+        published = self._publish("abc")
+        target = bob._fetch(self.cache, "abc", bob._ProgressBar())
+        self.assertEqual(target, os.path.join(self.cache, "bob", "bob_abc.jar"))
+        with open(published, "rb") as source, open(target, "rb") as downloaded:
+            self.assertEqual(source.read(), downloaded.read())
+        self.assertFalse(os.path.exists(target + ".part"))
+
+    def test_existing_jar_is_not_downloaded_again(self):
+        self._publish("abc")
+        target = bob._fetch(self.cache, "abc", bob._ProgressBar())
+        shutil.rmtree(self.archive)
+        self.assertEqual(bob._fetch(self.cache, "abc", bob._ProgressBar()), target)
+
+    def test_corrupt_jar_is_rejected(self):
+        self._publish("abc", b"not a jar")
+        with self.assertRaises(bob.DownloadError):
+            bob._fetch(self.cache, "abc", bob._ProgressBar())
+        self.assertFalse(os.path.exists(os.path.join(self.cache, "bob", "bob_abc.jar")))
+
+    def test_missing_version(self):
+        with self.assertRaises(bob.DownloadError):
+            bob._fetch(self.cache, "missing", bob._ProgressBar())
+
+
+if __name__ == "__main__":
+    unittest.main()
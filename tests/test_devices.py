@@ -0,0 +1,131 @@
+import os
+import stat
+import time
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import defbuild.devices as devices
+import defbuild.session as session
+import defbuild.commands as commands
+
+# Stand-ins for the device tools, every call is appended to calls.log. BBB222 fails installs the way older adb
+# versions do, with a Failure line and exit code 0
+_adb = """#!/bin/sh
+echo "adb $@" >> "{root}/calls.log"
+case "$1" in
+devices) printf 'List of devices attached\\nAAA111\\tdevice\\nBBB222\\tdevice\\nCCC333\\tunauthorized\\n';;
+-s) case "$3" in
+    install) sleep {delay}; [ "$2" = BBB222 ] && echo "Failure [INSTALL_FAILED_INSUFFICIENT_STORAGE]" || echo Success;;
+    shell) [ "$4" = pm ] && [ -e "{root}/installed_$2" ] && echo "package:/data/app/base.apk"; true;;
+    *) echo Success;;
+    esac;;
+esac
+"""
+
+_idevice_id = """#!/bin/sh
+echo "idevice_id $@" >> "{root}/calls.log"
+printf 'ios1\\n'
+"""
+
+_ideviceinstaller = """#!/bin/sh
+echo "ideviceinstaller $@" >> "{root}/calls.log"
+case "$3" in
+-i) echo "Install: Complete";;
+-l) printf 'CFBundleIdentifier, CFBundleVersion, CFBundleDisplayName\\ncom.example.game, "1.0", "Game"\\n';;
+esac
+"""
+
+
+class DevicesTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.tools = (devices.adb, devices.idevice_id, devices.ideviceinstaller, session._device_dir)
+        devices.adb = self._stub("adb", _adb)
+        devices.idevice_id = self._stub("idevice_id", _idevice_id)
+        devices.ideviceinstaller = self._stub("ideviceinstaller", _ideviceinstaller)
+        session._device_dir = os.path.join(self.root, "devices")
+
+        apk = os.path.join(self.root, "Game.apk")
+        ipa = os.path.join(self.root, "Game.ipa")
+        for path in [apk, ipa]:
+            with open(path, "w") as f:
+                f.write(path)
+        self.project = SimpleNamespace(name="Game", platforms=["armv7-android"], devices=None, jobs=None,
+                                       force=False, android_build=apk, ios_build=ipa,
+                                       android_id="com.example.game", ios_id="com.example.game")
+
+    def tearDown(self):
+        devices.adb, devices.idevice_id, devices.ideviceinstaller, session._device_dir = self.tools
+        shutil.rmtree(self.root)
+
+    def _stub(self, name, script, delay=0):
+        path = os.path.join(self.root, name)
+        with open(path, "w") as f:
+            f.write(script.format(root=self.root, delay=delay))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+        return path
+
+    def _calls(self, serial):
+        """The arguments of every adb call for serial"""
+        with open(os.path.join(self.root, "calls.log")) as f:
+            return [line.split()[1:] for line in f if line.split()[:3] == ["adb", "-s", serial]]
+
+    def test_device_filter(self):
+        found = devices.connected(["armv7-android", "armv7-darwin"])
+        self.assertEqual([x.serial for x in found], ["AAA111", "BBB222", "ios1"])
+        found = devices.connected(["armv7-android", "armv7-darwin"], ["BBB", "ios"])
+        self.assertEqual([x.serial for x in found], ["BBB222", "ios1"])
+
+    def test_results_run_in_parallel_and_keep_their_order(self):
+        devices.adb = self._stub("adb", _adb, delay=1)
+        found = devices.connected(["armv7-android"])
+        start = time.time()
+        results = devices.run_all([(x, x.install_command(self.project.android_build)) for x in found])
+        self.assertLess(time.time() - start, 1.8)
+        self.assertEqual([x.device.serial for x in results], ["AAA111", "BBB222"])
+        self.assertEqual([x.ok for x in results], [True, False])
+
+    def test_failure_output(self):
+        with self.assertLogs(level="INFO") as logs, self.assertRaises(SystemExit):
+            commands.install(self.project)
+        self.assertIn("INFO:root:        Failure [INSTALL_FAILED_INSUFFICIENT_STORAGE]", logs.output)
+        # Only the device that succeeded remembers the install
+        self.assertIsNotNone(devices.installed_hash(devices.Device("AAA111", "armv7-android"), "com.example.game"))
+        self.assertIsNone(devices.installed_hash(devices.Device("BBB222", "armv7-android"), "com.example.game"))
+
+    def test_uninstall_and_start(self):
+        self.project.devices = ["AAA"]
+        commands.uninstall(self.project)
+        commands.start(self.project)
+        self.assertEqual(self._calls("AAA111"), [
+            ["-s", "AAA111", "uninstall", "com.example.game"],
+            ["-s", "AAA111", "shell", "am", "start", "-n", "com.example.game/com.dynamo.android.DefoldActivity"]])
+
+    def test_skip_installed(self):
+        self.project.devices = ["AAA"]
+        commands.install(self.project)
+        open(os.path.join(self.root, "installed_AAA111"), "w").close()
+        with self.assertLogs(level="INFO") as logs:
+            commands.install(self.project)
+        self.assertIn("INFO:root:AAA111 already has this build installed, skipping", logs.output)
+        self.assertEqual(len([x for x in self._calls("AAA111") if x[2] == "install"]), 1)
+
+    def test_removed_app_is_installed_again(self):
+        self.project.devices = ["AAA"]
+        commands.install(self.project)
+        # Recorded as installed, but the stub no longer lists the package
+        commands.install(self.project)
+        self.assertEqual(len([x for x in self._calls("AAA111") if x[2] == "install"]), 2)
+
+    def test_ios_skip_installed(self):
+        self.project.platforms = ["armv7-darwin"]
+        commands.install(self.project)
+        with self.assertLogs(level="INFO") as logs:
+            commands.install(self.project)
+        self.assertIn("INFO:root:ios1 already has this build installed, skipping", logs.output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+import threading
+from types import SimpleNamespace
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import defbuild.cache as cache
+import defbuild.store as store
+
+
+class _StoreHandler(BaseHTTPRequestHandler):
+    """A stand-in artifact server that keeps what is PUT in memory"""
+    files = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b""):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path in self.files:
+            self._send(200, self.files[self.path])
+        else:
+            self._send(404)
+
+    do_HEAD = do_GET
+
+    def do_PUT(self):
+        self.files[self.path] = self.rfile.read(int(self.headers["Content-Length"]))
+        self._send(201)
+
+
+class HttpStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        _StoreHandler.files = {}
+        self.server = HTTPServer(("127.0.0.1", 0), _StoreHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.store = store.open_store("http://127.0.0.1:{}/cache/".format(self.server.server_port))
+        self.bundle = os.path.join(self.root, "Game.apk")
+        with open(self.bundle, "wb") as f:
+            f.write(os.urandom(3 * 1024 * 1024 + 17))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root)
+
+    def test_backend(self):
+        self.assertIsInstance(self.store, store.HttpStore)
+
+    def test_upload_and_download(self):
+        store.upload(self.store, "abcdef", self.bundle)
+        with open(self.bundle, "rb") as f:
+            data = f.read()
+        self.assertEqual(_StoreHandler.files["/cache/ab/abcdef/Game.apk"], data)
+        self.assertEqual(_StoreHandler.files["/cache/ab/abcdef/Game.apk.sha256"].decode("utf-8"),
+                         hashlib.sha256(data).hexdigest())
+
+        target = os.path.join(self.root, "restored", "Game.apk")
+        self.assertTrue(store.download(self.store, "abcdef", target))
+        with open(target, "rb") as f:
+            self.assertEqual(f.read(), data)
+
+    def test_missing_artifact(self):
+        target = os.path.join(self.root, "restored", "Game.apk")
+        self.assertFalse(store.download(self.store, "abcdef", target))
+        self.assertFalse(os.path.exists(target))
+
+    def test_checksum_mismatch_is_rejected(self):
+        store.upload(self.store, "abcdef", self.bundle)
+        _StoreHandler.files["/cache/ab/abcdef/Game.apk"] = b"corrupt"
+        target = os.path.join(self.root, "restored", "Game.apk")
+        self.assertFalse(store.download(self.store, "abcdef", target))
+        self.assertFalse(os.path.exists(target))
+        self.assertFalse(os.path.exists(os.path.dirname(target)))
+
+    def test_miss_keeps_local_cache_working(self):
+        project = SimpleNamespace(cache_dir=os.path.join(self.root, "cache"), platform="armv7-android",
+                                  android_build=os.path.join(self.root, "output", "Game.apk"),
+                                  build_cache_size="5120")
+        target = cache.entry_file(project, "abcdef")
+        self.assertFalse(store.download(self.store, "abcdef", target))
+        self.assertFalse(os.path.exists(os.path.dirname(target)))
+
+        os.makedirs(os.path.dirname(project.android_build))
+        shutil.copy2(self.bundle, project.android_build)
+        cache.store(project, "abcdef")
+        os.remove(project.android_build)
+        self.assertTrue(cache.restore(project, "abcdef"))
+        self.assertTrue(os.path.exists(project.android_build))
+
+    def test_existing_artifact_is_not_uploaded_again(self):
+        store.upload(self.store, "abcdef", self.bundle)
+        _StoreHandler.files["/cache/ab/abcdef/Game.apk"] = b"first"
+        store.upload(self.store, "abcdef", self.bundle)
+        self.assertEqual(_StoreHandler.files["/cache/ab/abcdef/Game.apk"], b"first")
+
+
+class FileStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = store.open_store(os.path.join(self.root, "shared"))
+        self.bundle = os.path.join(self.root, "Game.apk")
+        with open(self.bundle, "wb") as f:
+            f.write(b"bundle")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_upload_and_download(self):
+        store.upload(self.store, "abcdef", self.bundle)
+        target = os.path.join(self.root, "restored", "Game.apk")
+        self.assertTrue(store.download(self.store, "abcdef", target))
+        with open(target, "rb") as f:
+            self.assertEqual(f.read(), b"bundle")
+
+    def test_checksum_mismatch_is_rejected(self):
+        store.upload(self.store, "abcdef", self.bundle)
+        with open(os.path.join(self.root, "shared", "ab", "abcdef", "Game.apk"), "wb") as f:
+            f.write(b"corrupt")
+        target = os.path.join(self.root, "restored", "Game.apk")
+        self.assertFalse(store.download(self.store, "abcdef", target))
+        self.assertFalse(os.path.exists(target))
+
+
+if __name__ == "__main__":
+    unittest.main()